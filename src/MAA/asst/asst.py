@@ -1,5 +1,6 @@
 import ctypes
 import ctypes.util
+import importlib
 import json
 import os
 import pathlib
@@ -55,6 +56,11 @@ class Asst:
         else:
             lib_import_func = ctypes.CDLL
 
+        if loader := os.environ.get('ASST_LIB_LOADER'):
+            # "module:function" that returns a ctypes-compatible stand-in of MaaCore, e.g. the one of the benchmark
+            module_name, func_name = loader.split(':')
+            lib_import_func = getattr(importlib.import_module(module_name), func_name)
+
         Asst.__libpath = pathlib.Path(path) / platform_values[platform_type]['libpath']
         try:
             os.environ[platform_values[platform_type]['environ_var']] += os.pathsep + str(path)
@@ -80,6 +86,16 @@ class Asst:
 
         return ret
 
+    @staticmethod
+    def set_user_dir(user_dir: Union[pathlib.Path, str]) -> bool:
+        """
+        设置用户数据文件夹，用于已经 load 过的进程
+
+        :params:
+            ``user_dir``:   用户数据（日志、调试图片等）写入文件夹路径
+        """
+        return Asst.__lib.AsstSetUserDir(str(user_dir).encode('utf-8'))
+
     def __init__(self, callback: CallBackType = None, arg=None):
         """
         :params:
@@ -87,6 +103,7 @@ class Asst:
             ``arg``:        自定义参数
         """
         self.__callback = callback
+        self.__image_buffer: bytearray | None = None
         if callback:
             self.__ptr = Asst.__lib.AsstCreateEx(callback, arg)
         else:
@@ -145,14 +162,36 @@ class Asst:
 
         : return: 成功时图像的字节; 失败时 None
         """
-        buffer_type = ctypes.c_byte * size
-        buffer = buffer_type()
-        buffer.value = b'\000' * size
-        if (got := Asst.__lib.AsstGetImage(self.__ptr, buffer, size)) \
-                and got > 0:
-            return bytes(buffer)
-        else:
+        view = self.get_image_into(bytearray(size))
+        return bytes(view) if view is not None else None
+
+    def get_image_into(self, buffer: Union[bytearray, memoryview, ctypes.Array]) -> memoryview | None:
+        """
+        获取上次截图到调用方提供的可写缓冲区，不分配图像大小的内存也不拷贝
+        :params:
+            ``buffer``:  可写缓冲区, 大小即为可接收的最大图像字节数
+
+        : return: 成功时 buffer 中图像部分的 memoryview (可直接用于 numpy.frombuffer); 失败时 None
+        """
+        view = memoryview(buffer).cast('B')
+        c_buffer = (ctypes.c_ubyte * view.nbytes).from_buffer(view)
+        got = Asst.__lib.AsstGetImage(self.__ptr, c_buffer, view.nbytes)
+        # 失败时返回 NullSize ((uint64)-1)
+        if got == 0 or got == Asst.NullSize or got > view.nbytes:
             return None
+        return view[:got]
+
+    def get_image_view(self, size: int) -> memoryview | None:
+        """
+        获取上次截图到本实例复用的缓冲区
+        :params:
+            ``size``:  图像字节数, 如 1280*720*3
+
+        : return: 成功时图像的 memoryview, 下次调用时会被覆盖; 失败时 None
+        """
+        if self.__image_buffer is None or len(self.__image_buffer) != size:
+            self.__image_buffer = bytearray(size)
+        return self.get_image_into(self.__image_buffer)
 
     def set_connection_extras(name: str, extras: JSON):
         """
@@ -165,6 +204,8 @@ class Asst:
         Asst.__lib.AsstSetConnectionExtras(name.encode('utf-8'), json.dumps(extras, ensure_ascii=False).encode('utf-8'))
 
     TaskId = int
+    # MaaCore 的 AsstSize 失败值
+    NullSize = ctypes.c_uint64(-1).value
 
     def append_task(self, type_name: str, params: JSON = {}) -> TaskId:
         """
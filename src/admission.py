@@ -0,0 +1,111 @@
+'''
+Admission of task processes by the resources of the host, under devices_running_limit: a task is started only when
+
+    available memory - what the running tasks are still expected to take - the peak RSS expected of the task >= memory_headroom_mb
+    CPU usage since the last pass < max_cpu_percent
+
+What a task is expected to take is its peak RSS in its last run (default_task_rss_mb for a task never seen), a running
+task still takes its expected peak less its current RSS. Peaks are sampled by the runner every pass and kept in
+Data/Cache/peak_rss.json, memory_timeline does not have to be enabled.
+
+Once a resource delayed a task, it has to come back past its hysteresis (memory_hysteresis_mb more memory,
+cpu_hysteresis_percent less CPU) before tasks are admitted again, so that admission does not flap at the thresholds.
+Up to min_running tasks are always admitted.
+'''
+import logging
+from pathlib import Path
+from typing import Iterable
+
+import psutil
+
+import var
+from utils import read_json, write_json
+
+DEFAULT_ADMISSION = {
+    'enable': True,
+    'memory_headroom_mb': 1024,
+    'memory_hysteresis_mb': 512,
+    'max_cpu_percent': 90,
+    'cpu_hysteresis_percent': 15,
+    'default_task_rss_mb': 400,
+    'min_running': 1,
+}
+
+MB = 1024 ** 2
+
+
+def get_admission_config() -> dict:
+    return {**DEFAULT_ADMISSION, **var.global_config.get('admission', {})}
+
+
+class AdmissionController:
+    def __init__(self, config: dict, path: Path) -> None:
+        self.config = config
+        self.path = path
+        # task hash: peak RSS in bytes of its last run
+        self.peaks: dict[str, int] = {}
+        # task hash: [pid or None, current RSS, peak RSS of this run]
+        self.running: dict[str, list] = {}
+        self.throttled = {'memory': False, 'cpu': False}
+        if path.exists():
+            try:
+                self.peaks = read_json(path)
+            except Exception as e:
+                logging.warning(f'Failed to read {path}, peak RSS of tasks is unknown: {e}')
+        # the first call only starts the measurement
+        self.cpu_percent = psutil.cpu_percent(interval=None)
+
+    def expected_rss(self, task_hash) -> int:
+        return self.peaks.get(task_hash, self.config['default_task_rss_mb'] * MB)
+
+    def started(self, task_hash, pid: int | None):
+        '''
+        pid is None for a task without a process of its own (multi_instance), its memory is not sampled
+        '''
+        self.running[task_hash] = [pid, 0, 0]
+
+    def ended(self, task_hash):
+        pid, rss, peak = self.running.pop(task_hash, [None, 0, 0])
+        if peak:
+            self.peaks[task_hash] = peak
+
+    def sample(self):
+        '''
+        Once per pass of the runner: RSS of the running tasks and CPU usage since the last pass
+        '''
+        self.cpu_percent = psutil.cpu_percent(interval=None)
+        for task_hash, running in self.running.items():
+            if running[0] is None:
+                continue
+            try:
+                running[1] = psutil.Process(running[0]).memory_info().rss
+            except psutil.Error:
+                continue
+            running[2] = max(running[2], running[1])
+
+    def admit(self, task_hash, running_count: int, pending: Iterable[str] = ()) -> tuple[str, str] | None:
+        '''
+        None when the task can be started, otherwise (resource, why) of the delay.
+        pending: hashes of tasks which will start before it (the ones of devices launched for them)
+        '''
+        if not self.config['enable'] or running_count < self.config['min_running']:
+            return None
+
+        reserved = sum(max(0, self.expected_rss(_hash) - rss) for _hash, (pid, rss, peak) in self.running.items())
+        reserved += sum(self.expected_rss(_hash) for _hash in pending)
+        left = psutil.virtual_memory().available - reserved - self.expected_rss(task_hash)
+        headroom = self.config['memory_headroom_mb'] + (self.config['memory_hysteresis_mb'] if self.throttled['memory'] else 0)
+        self.throttled['memory'] = left < headroom * MB
+        max_cpu = self.config['max_cpu_percent'] - (self.config['cpu_hysteresis_percent'] if self.throttled['cpu'] else 0)
+        self.throttled['cpu'] = self.cpu_percent >= max_cpu
+
+        if self.throttled['memory']:
+            return 'memory', (f'{left / MB:.0f}MB would be left after {reserved / MB:.0f}MB still expected by the running (and pending) tasks '
+                              f'and {self.expected_rss(task_hash) / MB:.0f}MB expected by this one, under the headroom of {headroom:.0f}MB')
+        if self.throttled['cpu']:
+            return 'cpu', f'CPU usage is {self.cpu_percent:.0f}%, admitting below {max_cpu:.0f}%'
+        return None
+
+    def save(self):
+        if self.config['enable']:
+            write_json(self.path, self.peaks)
@@ -0,0 +1,84 @@
+'''
+A stand-in of the adb executable for the benchmark, set it as adb_path: "<python>" "<this file>"
+'''
+import struct
+import sys
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bench.scenario import load_scenario, read_device_state, write_device_state, is_device_up  # noqa: E402
+
+
+def png(width, height) -> bytes:
+    '''
+    A gray RGB png, the answer to screencap -p
+    '''
+    def chunk(type: bytes, data: bytes):
+        return struct.pack('>I', len(data)) + type + data + struct.pack('>I', zlib.crc32(type + data))
+
+    raw = b''.join(b'\x00' + b'\x7f' * (width * 3) for _ in range(height))
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+
+def main(argv: list[str]):
+    scenario = load_scenario()
+    time.sleep(scenario['adb_latency_sec'] * scenario['time_scale'])
+
+    serial = None
+    if len(argv) >= 2 and argv[0] == '-s':
+        serial, argv = argv[1], argv[2:]
+    if not argv:
+        return 1
+
+    command, args = argv[0], argv[1:]
+    shell = ' '.join(args).strip('"')
+    up = serial is None or is_device_up(scenario, serial)
+
+    if command == 'devices':
+        print('List of devices attached')
+    elif command == 'connect':
+        print(f'connected to {args[0] if args else serial}')
+    elif command == 'emu-launch':
+        # not an adb command, the launch command of the fake devices
+        state = read_device_state(scenario, serial)
+        if state.get('booted_at') is None:
+            state['booted_at'] = time.time() + scenario['boot_sec'] * scenario['time_scale']
+            write_device_state(scenario, serial, state)
+    elif not up:
+        print(f"adb: device '{serial}' not found", file=sys.stderr)
+        return 1
+    elif command == 'get-state':
+        print('device')
+    elif command in ('kill-server', 'start-server', 'disconnect'):
+        pass
+    elif command == 'install':
+        print('Success')
+    elif command == 'exec-out' and shell.startswith('screencap'):
+        sys.stdout.buffer.write(png(1280, 720))
+    elif command == 'shell':
+        if shell.startswith('pm list packages'):
+            from utils import arknights_package_name
+            version_code = scenario['game_version'].replace('.', '')
+            for package in arknights_package_name.values():
+                print(f'package:{package} versionCode:{version_code}')
+        elif 'getprop sys.boot_completed' in shell:
+            print('1')
+        elif 'versionName' in shell:
+            print(f'    versionName={scenario["game_version"]}')
+        elif shell.startswith('am force-stop') and serial:
+            package = shell.split(' ')[-1]
+            state = read_device_state(scenario, serial)
+            if state.get('package') == package:
+                state['package'] = None
+                write_device_state(scenario, serial, state)
+    else:
+        print(f'adb: unknown command {command}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,200 @@
+'''
+A python stand-in of MaaCore, loaded by Asst.load when ASST_LIB_LOADER=bench.fake_maacore:load_library.
+It emits scripted callbacks with the durations and failure rates of the benchmark scenario.
+'''
+import ctypes
+import itertools
+import json
+import logging
+import threading
+from pathlib import Path
+
+from MAA.asst.utils import Message
+from callback_journal import read_journal, split_segments, replay
+from bench.scenario import load_scenario, scaled_sleep, roll, get_maatask_script, read_device_state, write_device_state, is_device_up
+from utils import arknights_package_name
+
+logger = logging.getLogger('fake_maacore')
+
+
+class _Function:
+    '''
+    Asst sets restype/argtypes on every function of the library, plain bound methods don't accept that
+    '''
+
+    def __init__(self, func) -> None:
+        self._func = func
+        self.restype = None
+        self.argtypes = None
+
+    def __call__(self, *args):
+        return self._func(*args)
+
+
+class FakeInstance:
+    def __init__(self, core: 'FakeMaaCore', callback, arg) -> None:
+        self.core = core
+        self.callback = callback
+        self.arg = arg
+        self.address = None
+        self.pending: list[tuple[int, str, dict]] = []
+        self.running = False
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.task_ids = itertools.count(1)
+        self.segments = core.load_segments()
+        # stands for the models and images of a real instance, touched so that it is resident
+        self.ballast = b'\x01' * int(core.scenario['instance_rss_mb'] * 1024 ** 2)
+
+    def emit(self, msg: Message, details: dict):
+        if self.callback:
+            self.callback(msg.value, json.dumps(details).encode('utf-8'), self.arg)
+
+    def replay_segment(self):
+        self.pending.clear()
+        speed = 1 / self.core.scenario['time_scale'] if self.core.scenario['time_scale'] else 0
+        replay(self.segments.pop(0), lambda msg, details: self.callback and self.callback(msg, details, self.arg), speed)
+        self.running = False
+
+    def run(self):
+        if self.segments:
+            self.replay_segment()
+            return
+
+        scenario = self.core.scenario
+        while self.pending and not self.stop_event.is_set():
+            task_id, type, params = self.pending.pop(0)
+            details = {'taskchain': type, 'taskid': task_id}
+            script = get_maatask_script(scenario, type)
+            self.emit(Message.TaskChainStart, details)
+
+            duration = script['duration_sec']
+            if type == 'StartUp' and self.address:
+                package = arknights_package_name.get(params.get('client_type', 'Official'))
+                state = read_device_state(scenario, self.address)
+                if state.get('package') != package:
+                    # the runner force-stops the previous client, so a switch is a cold start of the game
+                    duration += scenario['switch_cost_sec']
+                    state['package'] = package
+                    state['starts'] = state.get('starts', 0) + 1
+                    write_device_state(scenario, self.address, state)
+            scaled_sleep(scenario, duration, self.stop_event)
+
+            if self.stop_event.is_set():
+                self.emit(Message.TaskChainStopped, details)
+                break
+            if type == 'Fight':
+                self.emit(Message.SubTaskExtraInfo, {**details, 'class': 'asst::SanityBeforeStageTaskPlugin', 'details': {'current_sanity': 0, 'max_sanity': 135}})
+            if roll(script['failure_rate']):
+                self.emit(Message.TaskChainError, details)
+            else:
+                self.emit(Message.TaskChainCompleted, details)
+        self.pending.clear()
+        self.emit(Message.AllTasksCompleted, {})
+        self.running = False
+
+
+class FakeMaaCore:
+    def __init__(self, path) -> None:
+        self.path = path
+        self.scenario = load_scenario()
+        self.instances: dict[int, FakeInstance] = {}
+        self.user_dir = None
+        self._handles = itertools.count(1)
+        for name in dir(self):
+            if name.startswith('Asst'):
+                setattr(self, name, _Function(getattr(self, name)))
+
+    def load_segments(self) -> list:
+        if not self.scenario.get('replay_dir') or not self.user_dir:
+            return []
+        journal = Path(self.scenario['replay_dir']) / f'{Path(self.user_dir).name}.bin'
+        return split_segments(read_journal(journal)) if journal.exists() else []
+
+    def AsstSetUserDir(self, path):
+        # the user dir is named after the task, it selects the journal to replay
+        self.user_dir = path.decode('utf-8')
+        return True
+
+    def AsstLoadResource(self, path):
+        scaled_sleep(self.scenario, self.scenario['load_sec'])
+        return True
+
+    def AsstSetStaticOption(self, option, value):
+        return True
+
+    def AsstSetConnectionExtras(self, name, extras):
+        return None
+
+    def AsstCreate(self):
+        return self.AsstCreateEx(None, None)
+
+    def AsstCreateEx(self, callback, arg):
+        handle = next(self._handles)
+        self.instances[handle] = FakeInstance(self, callback, arg)
+        return handle
+
+    def AsstDestroy(self, handle):
+        if instance := self.instances.pop(handle, None):
+            instance.stop_event.set()
+
+    def AsstSetInstanceOption(self, handle, option, value):
+        return True
+
+    def AsstConnect(self, handle, adb_path, address, config):
+        scaled_sleep(self.scenario, self.scenario['connect_sec'])
+        if not is_device_up(self.scenario, address.decode('utf-8')) or roll(self.scenario['connect_failure_rate']):
+            return False
+        self.instances[handle].address = address.decode('utf-8')
+        return True
+
+    def AsstAsyncConnect(self, handle, adb_path, address, config, block):
+        return 1 if self.AsstConnect(handle, adb_path, address, config) else 0
+
+    def AsstAppendTask(self, handle, type, params):
+        instance = self.instances[handle]
+        task_id = next(instance.task_ids)
+        instance.pending.append((task_id, type.decode('utf-8'), json.loads(params.decode('utf-8'))))
+        return task_id
+
+    def AsstSetTaskParams(self, handle, task_id, params):
+        return True
+
+    def AsstStart(self, handle):
+        instance = self.instances[handle]
+        if instance.running:
+            return False
+        instance.running = True
+        instance.stop_event.clear()
+        instance.thread = threading.Thread(target=instance.run, daemon=True)
+        instance.thread.start()
+        return True
+
+    def AsstStop(self, handle):
+        self.instances[handle].stop_event.set()
+        return True
+
+    def AsstRunning(self, handle):
+        return self.instances[handle].running
+
+    def AsstGetImage(self, handle, buffer, size):
+        # fill the caller's buffer in place like MaaCore does
+        ctypes.memset(buffer, 0x7f, size)
+        return size
+
+    def AsstGetVersion(self):
+        return b'v0.0.0-fake'
+
+    def AsstLog(self, level, message):
+        logger.debug(f'[{level.decode("utf-8")}] {message.decode("utf-8")}')
+
+
+_core: FakeMaaCore = None
+
+
+def load_library(path) -> FakeMaaCore:
+    # every Asst.load imports the library again, but instances must survive like with a real shared library
+    global _core
+    if not _core:
+        _core = FakeMaaCore(path)
+    return _core
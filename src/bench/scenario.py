@@ -0,0 +1,80 @@
+import json
+import os
+import random
+import time
+from pathlib import Path
+
+SCENARIO_ENV = 'ARKHELPER_BENCH_SCENARIO'
+
+DEFAULT_SCENARIO = {
+    # every duration below is multiplied by time_scale
+    'time_scale': 1.0,
+    'load_sec': 1.0,  # per AsstLoadResource
+    'connect_sec': 0.5,
+    'connect_failure_rate': 0.0,
+    'adb_latency_sec': 0.05,
+    'game_version': '2.2.21',
+    'switch_cost_sec': 10.0,  # extra StartUp time when the client is not running on the device yet (first start or server switch)
+    'boot_sec': 0.0,  # if set, devices are powered off until their launch command (fake_adb.py emu-launch) and boot for this long
+    'instance_rss_mb': 0,  # memory every MaaCore instance keeps resident
+    'maatasks': {
+        'default': {'duration_sec': 10.0, 'failure_rate': 0.0},
+        'StartUp': {'duration_sec': 20.0, 'failure_rate': 0.0},
+        'Fight': {'duration_sec': 60.0, 'failure_rate': 0.0}
+    },
+    'state_dir': None,  # where fake devices keep the running package, shared by the fake MaaCore and the fake adb
+    'replay_dir': None  # Data/Log/callbacks/<run> of a recorded run, its callbacks are replayed instead of the scripted ones
+}
+
+
+def load_scenario() -> dict:
+    scenario = json.loads(json.dumps(DEFAULT_SCENARIO))
+    if path := os.environ.get(SCENARIO_ENV):
+        with open(path, 'r', encoding='utf8') as file:
+            custom = json.load(file)
+        maatasks = custom.pop('maatasks', {})
+        scenario.update(custom)
+        scenario['maatasks'].update(maatasks)
+    return scenario
+
+
+def scaled_sleep(scenario: dict, sec: float, stop_event=None):
+    sec = sec * scenario['time_scale']
+    if stop_event:
+        stop_event.wait(sec)
+    else:
+        time.sleep(sec)
+
+
+def roll(rate: float) -> bool:
+    return rate > 0 and random.random() < rate
+
+
+def get_maatask_script(scenario: dict, type: str) -> dict:
+    return {**scenario['maatasks']['default'], **scenario['maatasks'].get(type, {})}
+
+
+def _state_file(scenario: dict, address: str) -> Path | None:
+    if not scenario.get('state_dir'):
+        return None
+    return Path(scenario['state_dir']) / (address.replace(':', '_') + '.json')
+
+
+def read_device_state(scenario: dict, address: str) -> dict:
+    file = _state_file(scenario, address)
+    if file and file.exists():
+        return json.loads(file.read_text(encoding='utf8') or '{}')
+    return {}
+
+
+def is_device_up(scenario: dict, address: str) -> bool:
+    if not scenario['boot_sec']:
+        return True
+    booted_at = read_device_state(scenario, address).get('booted_at')
+    return booted_at is not None and time.time() >= booted_at
+
+
+def write_device_state(scenario: dict, address: str, state: dict):
+    if file := _state_file(scenario, address):
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(json.dumps(state), encoding='utf8')
@@ -0,0 +1,535 @@
+'''
+Benchmarks which run without MaaCore and emulators.
+
+    python src/benchmark.py e2e --devices 4 --accounts 16 --time-scale 0.05
+    python src/benchmark.py image --frames 200
+    python src/benchmark.py proctable --processes 2000 --instances 32
+    python src/benchmark.py distributed --workers 2 --devices 2 --accounts 8 --kill-worker-after 20
+    python src/benchmark.py webhook --events 100 --delay-ms 200 --fail-every 5
+    python src/benchmark.py expand --accounts 5000
+
+e2e runs `main.py run` in a scratch directory against fake devices: MaaCore is replaced by bench.fake_maacore
+(through ASST_LIB_LOADER) and adb by bench/fake_adb.py. Durations and failure rates come from the scenario
+(see bench.scenario.DEFAULT_SCENARIO), --scenario accepts a json file overriding it.
+With --replay Data/Log/callbacks/<run> (recorded with record_callbacks: true) the fake MaaCore replays the recorded
+callbacks of each task instead, at the recorded pace multiplied by --time-scale.
+
+image compares Asst.get_image (a new bytes object per frame) with pooled buffers (get_image_into / get_image_view)
+against the fake MaaCore, counting the memory allocated per frame with tracemalloc.
+
+proctable resolves the MuMu processes of every instance on a synthetic process table, once by scanning the table per
+device as the emulator kill used to, once through one utils.ProcessTable. The scan does not include the system calls
+the old lookups made per device, the time of one ProcessTable.snapshot() of this host is reported next to it.
+
+distributed runs `main.py coordinator` and several `main.py worker` on localhost, each worker with its own fake devices,
+optionally killing the first worker midway to see its leases expire and its tasks requeued to the others.
+
+webhook sends progress events to a local HTTP sink, which answers slowly and fails some requests with 503,
+once through synchronous easywebhooker calls as the runner used to, once through webhooks.WebhookQueue.
+It reports how long the caller is blocked, the requests made and the events which reached the sink.
+
+expand expands synthetic accounts (the personal.yaml examples, repeated, so that hashes collide) with the example templates
+through maa_runner.expand_tasks, reporting its time, peak and retained memory, then materializes every task one at a time as dispatching does.
+'''
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import psutil
+import yaml
+
+SRC = Path(__file__).parent
+SERVERS = ['Official', 'Bilibili', 'YoStarEN', 'YoStarJP']
+
+E2E_TEMPLATE = [
+    {'task_name': 'StartUp', 'task_config': {'enable': True, 'client_type': 'Official', 'start_game_enabled': True, 'account_name': ''}},
+    {'task_name': 'Fight', 'task_config': {'enable': True, 'stage': '1-7', 'standby_stage': '1-7', 'medicine': 0, 'stone': 0, 'times': 2147483647}},
+    {'task_name': 'Infrast', 'task_config': {'facility': ['Mfg', 'Trade', 'Power'], 'drones': 'PureGold', 'threshold': 0.2}},
+    {'task_name': 'Award', 'task_config': {'award': True, 'mail': True}},
+]
+
+
+def parse_set_options(options: list[str]) -> dict:
+    result = {}
+    for option in options or []:
+        key, _, value = option.partition('=')
+        result[key] = yaml.safe_load(value)
+    return result
+
+
+def write_e2e_workdir(workdir: Path, args, first_device=0) -> Path:
+    config_path = workdir / 'Data' / 'Config'
+    config_path.mkdir(parents=True, exist_ok=True)
+    (workdir / 'maa').mkdir(exist_ok=True)
+
+    global_config = {
+        'adb_path': f'"{sys.executable}" "{SRC / "bench" / "fake_adb.py"}"',
+        'maa_path': str(workdir / 'maa'),
+        'max_task_waiting_time': 3600,
+        'devices_running_limit': args.devices,
+        'check_game_update': False,
+        'devices': [{
+            'alias': f'fake{i}',
+            'emulator_address': f'127.0.0.1:{16384 + 32 * i}',
+            'launch': f'"{sys.executable}" "{SRC / "bench" / "fake_adb.py"}" -s 127.0.0.1:{16384 + 32 * i} emu-launch',
+            'kill_after_end': False
+        } for i in range(first_device, first_device + args.devices)]
+    }
+    global_config.update(parse_set_options(args.set))
+    personal = [{'client_type': SERVERS[i % args.servers], 'account_name': str(i), 'override': {}} for i in range(args.accounts)]
+
+    (config_path / 'global.yaml').write_text(yaml.safe_dump(global_config), encoding='utf8')
+    (config_path / 'personal.yaml').write_text(yaml.safe_dump(personal), encoding='utf8')
+    (config_path / 'template_default.yaml').write_text(yaml.safe_dump(E2E_TEMPLATE, allow_unicode=True), encoding='utf8')
+
+    scenario = json.loads(Path(args.scenario).read_text(encoding='utf8')) if args.scenario else {}
+    scenario['time_scale'] = args.time_scale
+    if args.boot_sec is not None:
+        scenario['boot_sec'] = args.boot_sec
+    scenario['state_dir'] = str(workdir / 'fake_devices')
+    if args.replay:
+        scenario['replay_dir'] = str(Path(args.replay).absolute())
+    scenario_file = workdir / 'scenario.json'
+    scenario_file.write_text(json.dumps(scenario), encoding='utf8')
+    return scenario_file
+
+
+def monitor(proc: subprocess.Popen, interval=0.2) -> dict:
+    '''
+    Poll the process tree until the root exits, cpu time of exited processes is kept from their last sample
+    '''
+    root = psutil.Process(proc.pid)
+    cpu_by_pid, peak_rss, peak_processes, seen = {}, 0, 0, set()
+    while proc.poll() is None:
+        try:
+            processes = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            break
+        rss = 0
+        for p in processes:
+            try:
+                cpu = p.cpu_times()
+                cpu_by_pid[p.pid] = cpu.user + cpu.system
+                rss += p.memory_info().rss
+                seen.add(p.pid)
+            except psutil.Error:
+                pass
+        peak_rss = max(peak_rss, rss)
+        peak_processes = max(peak_processes, len(processes))
+        time.sleep(interval)
+    return {
+        'cpu_sec': sum(cpu_by_pid.values()),
+        'peak_rss_mb': peak_rss / 1024 ** 2,
+        'peak_processes': peak_processes,
+        'processes_spawned': len(seen)
+    }
+
+
+def analyze_trace(workdir: Path) -> dict:
+    trace_files = sorted((workdir / 'conclusion').glob('*.trace.json'))
+    if not trace_files:
+        return {}
+    events = json.loads(trace_files[-1].read_text(encoding='utf8'))['traceEvents']
+    device_events = [e for e in events if e.get('ph') == 'X' and e.get('cat') == 'device']
+
+    first_dispatch, between_tasks = [], []
+    for device in set(e['args']['device'] for e in device_events):
+        idles = sorted((e for e in device_events if e['args']['device'] == device and e['name'] == 'idle'), key=lambda e: e['ts'])
+        if idles:
+            first_dispatch.append(idles[0]['dur'] / 1e6)
+            between_tasks += [e['dur'] / 1e6 for e in idles[1:]]
+    spawns = [e['dur'] / 1e6 for e in device_events if e['name'] == 'spawn']
+
+    def stats(values):
+        return {'mean': sum(values) / len(values), 'max': max(values)} if values else None
+
+    summary_files = sorted((workdir / 'conclusion').glob('*.trace-summary.json'))
+    summary = json.loads(summary_files[-1].read_text(encoding='utf8')) if summary_files else {}
+    return {
+        'tasks': len([e for e in device_events if e['name'] == 'task']),
+        'first_dispatch_sec': stats(first_dispatch),
+        'dispatch_gap_sec': stats(between_tasks),
+        'spawn_sec': stats(spawns),
+        'device_utilization': {device: u['utilization'] for device, u in summary.get('devices', {}).items()}
+    }
+
+
+def count_game_starts(workdir: Path) -> int:
+    state_dir = workdir / 'fake_devices'
+    return sum(json.loads(f.read_text(encoding='utf8')).get('starts', 0) for f in state_dir.glob('*.json')) if state_dir.exists() else 0
+
+
+def get_bench_env(scenario_file: Path) -> dict:
+    env = os.environ.copy()
+    env['ASST_LIB_LOADER'] = 'bench.fake_maacore:load_library'
+    env['ARKHELPER_BENCH_SCENARIO'] = str(scenario_file)
+    env['PYTHONPATH'] = os.pathsep.join([str(SRC)] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    return env
+
+
+def bench_e2e(args):
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix='akh-bench-'))
+    workdir.mkdir(parents=True, exist_ok=True)
+    scenario_file = write_e2e_workdir(workdir, args)
+    env = get_bench_env(scenario_file)
+
+    start = time.time()
+    with open(workdir / 'bench_stdout.txt', 'wb') as output:
+        proc = subprocess.Popen([sys.executable, str(SRC / 'main.py'), 'run'], cwd=str(workdir), env=env, stdout=output, stderr=subprocess.STDOUT)
+        resources = monitor(proc)
+        proc.wait()
+    makespan = time.time() - start
+
+    result = {
+        'devices': args.devices,
+        'accounts': args.accounts,
+        'servers': args.servers,
+        'time_scale': args.time_scale,
+        'exit_code': proc.returncode,
+        'makespan_sec': makespan,
+        'game_starts': count_game_starts(workdir),
+        **resources,
+        **analyze_trace(workdir),
+        'workdir': str(workdir)
+    }
+    (workdir / 'bench_result.json').write_text(json.dumps(result, indent=2), encoding='utf8')
+    print(json.dumps(result, indent=2))
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def bench_distributed(args):
+    root = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix='akh-bench-'))
+    distributed = {'port': args.port, 'coordinator': f'http://127.0.0.1:{args.port}', 'lease_sec': args.lease_sec, 'heartbeat_sec': max(args.lease_sec / 5, 1)}
+    args.set = (args.set or []) + [f'distributed={json.dumps(distributed)}']
+
+    def start(name, command: list[str], first_device=0):
+        workdir = root / name
+        workdir.mkdir(parents=True, exist_ok=True)
+        env = get_bench_env(write_e2e_workdir(workdir, args, first_device))
+        output = open(workdir / 'bench_stdout.txt', 'wb')
+        return subprocess.Popen([sys.executable, str(SRC / 'main.py'), *command], cwd=str(workdir), env=env, stdout=output, stderr=subprocess.STDOUT)
+
+    start_time = time.time()
+    coordinator = start('coordinator', ['coordinator'])
+    time.sleep(1)
+    workers = [start(f'worker{i}', ['worker', '--id', f'worker{i}'], i * args.devices) for i in range(args.workers)]
+
+    killed = False
+    while coordinator.poll() is None:
+        if args.kill_worker_after and not killed and time.time() - start_time > args.kill_worker_after:
+            for p in [psutil.Process(workers[0].pid)] + psutil.Process(workers[0].pid).children(recursive=True):
+                p.kill()
+            killed = True
+        time.sleep(0.2)
+    makespan = time.time() - start_time
+    for worker in workers:
+        try:
+            worker.wait(30)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+    log = (root / 'coordinator' / 'bench_stdout.txt').read_text(encoding='utf8', errors='replace')
+    finished_by = re.findall(r'Task \S+ finished on worker ([\w.-]+)', log)
+    result = {
+        'workers': args.workers,
+        'devices_per_worker': args.devices,
+        'accounts': args.accounts,
+        'coordinator_exit_code': coordinator.returncode,
+        'makespan_sec': makespan,
+        'tasks_finished': len(finished_by),
+        'tasks_by_worker': {worker: finished_by.count(worker) for worker in sorted(set(finished_by))},
+        'worker_killed': killed,
+        'leases_requeued': len(re.findall(r'expired, requeued', log)),
+        'workdir': str(root)
+    }
+    print(json.dumps(result, indent=2))
+    if not args.keep and not args.workdir:
+        shutil.rmtree(root, ignore_errors=True)
+    return result
+
+
+def use_fake_maacore(scenario: dict | None = None):
+    '''
+    Load the fake MaaCore into this process
+    '''
+    scenario_file = Path(tempfile.mkdtemp(prefix='akh-bench-')) / 'scenario.json'
+    scenario_file.write_text(json.dumps({'time_scale': 0, **(scenario or {})}), encoding='utf8')
+    os.environ['ASST_LIB_LOADER'] = 'bench.fake_maacore:load_library'
+    os.environ['ARKHELPER_BENCH_SCENARIO'] = str(scenario_file)
+
+    from MAA.asst.asst import Asst
+    Asst.load(scenario_file.parent)
+    return Asst
+
+
+def bench_image(args):
+    Asst = use_fake_maacore()
+    from capture import ImageBufferPool
+
+    asst = Asst()
+    pool = ImageBufferPool(args.size, 2)
+    candidates = {
+        'get_image': lambda: asst.get_image(args.size),
+        'get_image_view': lambda: asst.get_image_view(args.size),
+        'get_image_into(pool)': lambda: asst.get_image_into(pool.acquire())
+    }
+
+    result = {'frame_size': args.size, 'frames': args.frames}
+    tracemalloc.start()
+    for name, grab in candidates.items():
+        grab()  # warm up, so that buffers owned by the instance or the pool are not counted
+        allocated, start = 0, time.perf_counter()
+        for _ in range(args.frames):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            frame = grab()
+            allocated += tracemalloc.get_traced_memory()[1] - base
+            del frame
+        elapsed = time.perf_counter() - start
+        result[name] = {
+            'bytes_allocated_per_frame': allocated / args.frames,
+            'frame_allocations_per_frame': round(allocated / args.frames / args.size, 2),
+            'usec_per_frame': elapsed / args.frames * 1e6
+        }
+    tracemalloc.stop()
+
+    print(json.dumps(result, indent=2))
+    return result
+
+
+def synthetic_process_table(process_count, instance_count):
+    processes, connections = [], []
+    for pid in range(1000, 1000 + process_count):
+        processes.append({'pid': pid, 'name': f'proc{pid % 97}.exe', 'cmdline': [f'proc{pid % 97}.exe', '--flag']})
+        connections += [(random.randint(20000, 60000), pid) for _ in range(2)]
+    for index in range(instance_count):
+        headless, player = 100000 + 2 * index, 100001 + 2 * index
+        processes.append({'pid': headless, 'name': 'MuMuVMMHeadless.exe', 'cmdline': ['MuMuVMMHeadless.exe', '--comment', f'MuMuPlayer-12.0-{index}', '--startvm', 'x']})
+        processes.append({'pid': player, 'name': 'MuMuPlayer.exe', 'cmdline': ['MuMuPlayer.exe', '-v', str(index)]})
+        connections.append((16384 + 32 * index, headless))
+    random.shuffle(processes)
+    random.shuffle(connections)
+    return processes, connections
+
+
+def bench_proctable(args):
+    from utils import ProcessTable, get_pid_by_port, get_MuMuPlayer_by_MuMuVMMHeadless, prase_MuMuVMMHeadless_commandline, prase_MuMuPlayer_commandline
+
+    processes, connections = synthetic_process_table(args.processes, args.instances)
+    ports = [16384 + 32 * index for index in range(args.instances)]
+
+    def scan(port):
+        headless = next((pid for p, pid in connections if p == port), None)
+        cmdline = next(p['cmdline'] for p in processes if p['pid'] == headless)
+        index = prase_MuMuVMMHeadless_commandline(cmdline)['index']
+        return headless, next((p['pid'] for p in processes if p['name'] == 'MuMuPlayer.exe' and prase_MuMuPlayer_commandline(p['cmdline'])['index'] == index), None)
+
+    def indexed():
+        table = ProcessTable(processes, connections)
+        result = []
+        for port in ports:
+            headless = get_pid_by_port(port, table)
+            result.append((headless, get_MuMuPlayer_by_MuMuVMMHeadless(headless, table)))
+        return result
+
+    start = time.perf_counter()
+    scanned = [scan(port) for port in ports]
+    scan_sec = time.perf_counter() - start
+    start = time.perf_counter()
+    found = indexed()
+    indexed_sec = time.perf_counter() - start
+    assert scanned == found
+
+    start = time.perf_counter()
+    host_table = ProcessTable.snapshot()
+    snapshot_sec = time.perf_counter() - start
+
+    result = {
+        'processes': args.processes,
+        'instances': args.instances,
+        'scan_per_device_ms': scan_sec * 1000,
+        'process_table_ms': indexed_sec * 1000,
+        'host_snapshot_ms': snapshot_sec * 1000,
+        'host_processes': len(host_table.names)
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+def start_webhook_sink(port, delay_ms, fail_every):
+    '''
+    Collects the events of every POST body, every fail_every-th request fails with 503
+    '''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import threading
+
+    state = {'requests': 0, 'events': []}
+    lock = threading.Lock()
+
+    class SinkHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            time.sleep(delay_ms / 1000)
+            with lock:
+                state['requests'] += 1
+                failed = fail_every and state['requests'] % fail_every == 0
+                if not failed:
+                    state['events'] += body.get('events', [])
+            self.send_response(503 if failed else 200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), SinkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def bench_webhook(args):
+    import easywebhooker
+    from webhooks import WebhookQueue
+
+    hooks = [{
+        'when': ['task-started', 'task-finished', 'maatask-failed', 'run-finished'],
+        'method': 'POST',
+        'url': f'http://127.0.0.1:{args.port}/',
+        'body': "{'event': event, 'events': events}"
+    }]
+    events = [('task-started' if i % 2 == 0 else 'task-finished', {'task': f'Official{i // 2}'}) for i in range(args.events)]
+    result = {'events': args.events, 'delay_ms': args.delay_ms, 'fail_every': args.fail_every}
+
+    server, state = start_webhook_sink(args.port, args.delay_ms, args.fail_every)
+    start, blocked = time.perf_counter(), 0
+    for event, variables in events:
+        emit_start = time.perf_counter()
+        easywebhooker.webhook(event, hooks, event=event, events=[variables], **variables)
+        blocked = max(blocked, time.perf_counter() - emit_start)
+    result['synchronous'] = {'caller_blocked_sec': time.perf_counter() - start, 'max_emit_ms': blocked * 1000,
+                             'requests': state['requests'], 'events_delivered': len(state['events'])}
+    server.shutdown()
+
+    server, state = start_webhook_sink(args.port + 1, args.delay_ms, args.fail_every)
+    hooks[0]['url'] = f'http://127.0.0.1:{args.port + 1}/'
+    queue = WebhookQueue(hooks, retries=3, backoff_base=0.1, backoff_cap=1, batch_sec=args.batch_sec)
+    start, blocked = time.perf_counter(), 0
+    for event, variables in events:
+        emit_start = time.perf_counter()
+        queue.emit(event, **variables)
+        blocked = max(blocked, time.perf_counter() - emit_start)
+        time.sleep(args.interval_ms / 1000)
+    caller_sec = time.perf_counter() - start - args.events * args.interval_ms / 1000
+    queue.flush(600)
+    result['queued'] = {'caller_blocked_sec': caller_sec, 'max_emit_ms': blocked * 1000, 'delivered_after_sec': time.perf_counter() - start,
+                        'requests': state['requests'], 'events_delivered': len(state['events'])}
+    server.shutdown()
+
+    print(json.dumps(result, indent=2))
+    return result
+
+
+def bench_expand(args):
+    import var
+    import maa_runner
+
+    examples = SRC.parent / 'Docs' / 'examples'
+    var.global_config = {'once_per_game_day': []}
+    var.config_templates = {file.stem.replace('template_', ''): yaml.safe_load(file.read_text(encoding='utf8')) for file in examples.glob('template_*.yaml')}
+    var.cache_path = Path(tempfile.mkdtemp(prefix='akh-bench-'))
+    personal = yaml.safe_load((examples / 'personal.yaml').read_text(encoding='utf8'))
+    # as if parsed from one big personal.yaml, every account has its own dicts
+    var.personal_configs = [{**copy.deepcopy(personal[i % len(personal)]), 'account_name': str(i % (args.accounts // 2 or 1))} for i in range(args.accounts)]
+    var.tasks = []
+
+    result = {'accounts': args.accounts}
+    tracemalloc.start()
+    start = time.perf_counter()
+    maa_runner.expand_tasks()
+    result['expand_sec'] = time.perf_counter() - start
+    result['retained_mb'], result['expand_peak_mb'] = (m / 1024 ** 2 for m in tracemalloc.get_traced_memory())
+    tracemalloc.stop()
+    # one at a time, as dispatching does
+    start = time.perf_counter()
+    maatasks = sum(len(maa_runner.materialize_task(task)['task']) for task in var.tasks)
+    result['materialize_sec'] = time.perf_counter() - start
+    result['tasks'] = len(var.tasks)
+    result['maatasks'] = maatasks
+    print(json.dumps(result, indent=2))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ArkHelperCLI benchmarks')
+    subparsers = parser.add_subparsers(title='Benchmarks', dest='benchmark', required=True)
+
+    parser_e2e = subparsers.add_parser('e2e', help='Run maa_runner.run against fake devices and a fake MaaCore')
+    parser_e2e.add_argument('--devices', type=int, default=4)
+    parser_e2e.add_argument('--accounts', type=int, default=8)
+    parser_e2e.add_argument('--servers', type=int, default=1, choices=range(1, len(SERVERS) + 1), help='Accounts are spread over this many client types, interleaved')
+    parser_e2e.add_argument('--time-scale', type=float, default=0.05, help='Multiplier of every scripted duration')
+    parser_e2e.add_argument('--boot-sec', type=float, help='Devices start powered off and boot this long (before --time-scale) after their launch command')
+    parser_e2e.add_argument('--scenario', help='Json file overriding bench.scenario.DEFAULT_SCENARIO')
+    parser_e2e.add_argument('--replay', metavar='DIR', help='Replay the callback journals of a recorded run')
+    parser_e2e.add_argument('--set', action='append', metavar='KEY=VALUE', help='Override a field of the generated global.yaml, the value is parsed as yaml')
+    parser_e2e.add_argument('--workdir', help='Directory to run in, a temporary one is used (and removed) by default')
+    parser_e2e.add_argument('--keep', action='store_true', help='Keep the temporary directory')
+
+    parser_image = subparsers.add_parser('image', help='Allocations per frame of the screenshot API')
+    parser_image.add_argument('--frames', type=int, default=200)
+    parser_image.add_argument('--size', type=int, default=1280 * 720 * 3)
+
+    parser_proctable = subparsers.add_parser('proctable', help='Emulator process lookups on a synthetic process table')
+    parser_proctable.add_argument('--processes', type=int, default=2000)
+    parser_proctable.add_argument('--instances', type=int, default=32)
+
+    parser_distributed = subparsers.add_parser('distributed', help='A coordinator and several workers on localhost, each with its own fake devices')
+    parser_distributed.add_argument('--workers', type=int, default=2)
+    parser_distributed.add_argument('--devices', type=int, default=2, help='Per worker')
+    parser_distributed.add_argument('--accounts', type=int, default=8)
+    parser_distributed.add_argument('--servers', type=int, default=1, choices=range(1, len(SERVERS) + 1))
+    parser_distributed.add_argument('--time-scale', type=float, default=0.05)
+    parser_distributed.add_argument('--port', type=int, default=18765)
+    parser_distributed.add_argument('--lease-sec', type=float, default=10)
+    parser_distributed.add_argument('--kill-worker-after', type=float, metavar='SEC', help='Kill the first worker (and its task processes) after this long')
+    parser_distributed.add_argument('--workdir', help='Directory to run in, a temporary one is used (and removed) by default')
+    parser_distributed.add_argument('--keep', action='store_true', help='Keep the temporary directory')
+    parser_distributed.set_defaults(set=None, scenario=None, replay=None, boot_sec=None)
+
+    parser_webhook = subparsers.add_parser('webhook', help='Progress events to a slow, flaky local HTTP sink, synchronous and queued')
+    parser_webhook.add_argument('--events', type=int, default=100)
+    parser_webhook.add_argument('--interval-ms', type=float, default=10, help='Between two events, for the queued delivery')
+    parser_webhook.add_argument('--delay-ms', type=float, default=200, help='Response time of the sink')
+    parser_webhook.add_argument('--fail-every', type=int, default=5, help='Every n-th request gets 503, 0 for none')
+    parser_webhook.add_argument('--batch-sec', type=float, default=0.5)
+    parser_webhook.add_argument('--port', type=int, default=18770, help='The queued delivery uses the next one')
+
+    parser_expand = subparsers.add_parser('expand', help='Expansion of many accounts from the example templates')
+    parser_expand.add_argument('--accounts', type=int, default=5000)
+
+    args = parser.parse_args()
+    {
+        'e2e': bench_e2e,
+        'distributed': bench_distributed,
+        'image': bench_image,
+        'proctable': bench_proctable,
+        'webhook': bench_webhook,
+        'expand': bench_expand
+    }[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+'''
+Append-only binary journal of MaaCore callbacks.
+
+The file starts with MAGIC, then every record is a RECORD header (timestamp, message, length of details)
+followed by the details exactly as MaaCore passed them (utf-8 json).
+'''
+import json
+import logging
+import struct
+import time
+from pathlib import Path
+from typing import Iterator
+
+import var
+from MAA.asst.utils import Message
+from utils import convert_str_to_legal_filename_windows
+
+MAGIC = b'AKHCB\x01'
+RECORD = struct.Struct('<dII')
+
+
+def get_journal_dir(run_id=None) -> Path:
+    return var.log_path / 'callbacks' / (run_id or var.run_id)
+
+
+def get_journal_file(task_id, run_id=None) -> Path:
+    return get_journal_dir(run_id) / f'{convert_str_to_legal_filename_windows(task_id)}.bin'
+
+
+class CallbackRecorder:
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._file = open(str(path), 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def write(self, msg: int, details: bytes, timestamp: float | None = None):
+        self._file.write(RECORD.pack(time.time() if timestamp is None else timestamp, msg, len(details)) + details)
+        # a crash of the task process still leaves every received callback on disk
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_journal(path: Path) -> Iterator[tuple[float, int, bytes]]:
+    with open(str(path), 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise Exception(f'{path} is not a callback journal')
+        while len(header := file.read(RECORD.size)) == RECORD.size:
+            timestamp, msg, length = RECORD.unpack(header)
+            details = file.read(length)
+            if len(details) != length:
+                logging.warning(f'Callback journal {path} is truncated')
+                return
+            yield timestamp, msg, details
+
+
+def split_segments(records) -> list[list[tuple[float, int, bytes]]]:
+    '''
+    One segment per Asst.start: from TaskChainStart to AllTasksCompleted. Callbacks out of any segment (e.g. ConnectionInfo) are dropped
+    '''
+    segments, current = [], None
+    for record in records:
+        msg = record[1]
+        if current is None:
+            if msg != Message.TaskChainStart.value:
+                continue
+            current = []
+        current.append(record)
+        if msg == Message.AllTasksCompleted.value:
+            segments.append(current)
+            current = None
+    if current:
+        segments.append(current)
+    return segments
+
+
+def replay(records, emit, speed=1.0):
+    '''
+    Call emit(msg, details) for every record, keeping the recorded gaps divided by speed (0 means no waiting)
+    '''
+    last_timestamp = None
+    for timestamp, msg, details in records:
+        if speed and last_timestamp is not None:
+            time.sleep(max(timestamp - last_timestamp, 0) / speed)
+        last_timestamp = timestamp
+        emit(msg, details)
+
+
+def replay_into_proxy(path: Path, asstproxy, speed=1.0):
+    '''
+    Feed a recorded journal into AsstProxy.process_callback (or anything with the same signature)
+    '''
+    replay(read_journal(path), lambda msg, details: asstproxy.process_callback(Message(msg), json.loads(details.decode('utf-8')), None), speed)
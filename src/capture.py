@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+from MAA.asst.asst import Asst
+from model import ADB
+
+FRAME_SIZE = 1280 * 720 * 3
+
+
+class ImageBufferPool:
+    '''
+    Fixed set of writable frame buffers which are handed out round-robin, nothing is allocated after creation.
+    A buffer is overwritten once the pool wraps around, so a consumer must be done with a frame within `count` captures.
+    '''
+
+    def __init__(self, size=FRAME_SIZE, count=2) -> None:
+        self.size = size
+        self._buffers = [bytearray(size) for _ in range(count)]
+        self._next = 0
+
+    def acquire(self) -> bytearray:
+        buffer = self._buffers[self._next]
+        self._next = (self._next + 1) % len(self._buffers)
+        return buffer
+
+
+class CaptureLoop(threading.Thread):
+    '''
+    Periodically copy the last screenshot of an Asst into pooled buffers and pass a memoryview of it to on_frame(frame, timestamp)
+    '''
+
+    def __init__(self, asst: Asst, on_frame: Callable[[memoryview, float], None], interval=1.0, size=FRAME_SIZE, pool_count=2, logger: logging.Logger = None) -> None:
+        threading.Thread.__init__(self, name='capture-loop', daemon=True)
+        self.asst = asst
+        self.on_frame = on_frame
+        self.interval = interval
+        self.pool = ImageBufferPool(size, pool_count)
+        self.frames = 0
+        self._logger = logger or logging.getLogger('capture')
+        self._stop_event = threading.Event()
+
+    def grab(self) -> memoryview | bytes | None:
+        return self.asst.get_image_into(self.pool.acquire())
+
+    def capture(self) -> bool:
+        frame = self.grab()
+        if not frame:
+            return False
+        self.frames += 1
+        self.on_frame(frame, time.time())
+        return True
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.capture()
+            except Exception as e:
+                self._logger.debug(f'Capture failed: {e}')
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(self.interval + 1)
+
+
+class ScreencapLoop(CaptureLoop):
+    '''
+    CaptureLoop streaming `adb exec-out screencap -p`, for when no Asst instance is connected to the device
+    '''
+
+    def __init__(self, adb: ADB, on_frame: Callable[[memoryview | bytes, float], None], interval=1.0, logger: logging.Logger = None) -> None:
+        CaptureLoop.__init__(self, None, on_frame, interval, 0, 0, logger)
+        self.adb = adb
+
+    def grab(self) -> bytes:
+        return self.adb.screencap(max(self.interval * 5, 5))
@@ -0,0 +1,197 @@
+'''
+Daemon mode: one long-running process runs accounts on cron schedules and on demand, without paying the startup
+of the CLI again for every run. Configs stay parsed, devices (and their caches), the multiprocessing manager and,
+with fork_server or multi_instance, the zygotes or instance hosts are kept between runs.
+
+    python main.py daemon
+
+Local API (daemon.host:daemon.port of global config, default 127.0.0.1:8766):
+    POST /runs     {"accounts": ["Official123", ...]}    queue a run, of every account if accounts is omitted
+    POST /reload                                        parse personal config and templates again
+    GET  /status                                        current and queued runs, next scheduled times, last results
+'''
+import logging
+import multiprocessing
+import queue
+import threading
+from datetime import datetime, timedelta
+
+import var
+import tracing
+import http_api
+from utils import read_config, get_config_templates
+from model import Device
+from maa_runner import expand_tasks, execute, send_report, create_process_pool, get_journal_file
+from journal import RunJournal
+from task_source import LocalTaskSource
+
+DEFAULT_DAEMON = {
+    'host': '127.0.0.1',
+    'port': 8766,
+    'schedules': []
+}
+
+
+def get_daemon_config() -> dict:
+    return {**DEFAULT_DAEMON, **var.global_config.get('daemon', {}), **var.mode_args}
+
+
+class CronSchedule:
+    '''
+    Standard 5 fields cron expression (minute hour day-of-month month day-of-week) in local time.
+    Supports *, lists, ranges and steps. As in cron, a time matches either day field when both are restricted
+    '''
+    RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields: {expression}')
+        self.minutes, self.hours, self.days, self.months, weekdays = [self._parse(field, *r) for field, r in zip(fields, self.RANGES)]
+        # 0 and 7 are both sunday
+        self.weekdays = {d % 7 for d in weekdays}
+        self._days_restricted = fields[2] != '*'
+        self._weekdays_restricted = fields[4] != '*'
+
+    @staticmethod
+    def _parse(field: str, low, high) -> set[int]:
+        values = set()
+        for part in field.split(','):
+            span, _, step = part.partition('/')
+            if span == '*':
+                start, end = low, high
+            elif '-' in span:
+                start, end = map(int, span.split('-'))
+            else:
+                start = int(span)
+                end = high if step else start
+            if start < low or end > high:
+                raise ValueError(f'{part} is out of {low}-{high}')
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def matches(self, time: datetime) -> bool:
+        if time.minute not in self.minutes or time.hour not in self.hours or time.month not in self.months:
+            return False
+        day = time.day in self.days
+        weekday = (time.weekday() + 1) % 7 in self.weekdays
+        if self._days_restricted and self._weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, time: datetime) -> datetime | None:
+        time = time.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        for _ in range(366 * 24 * 60):
+            if self.matches(time):
+                return time
+            time += timedelta(minutes=1)
+        return None
+
+
+class Daemon:
+    def __init__(self, config: dict) -> None:
+        self.schedules = [(CronSchedule(entry['cron']), entry) for entry in config['schedules']]
+        self.runs: queue.Queue[dict] = queue.Queue()
+        self.current: dict | None = None
+        self.last_results: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger('daemon')
+        # warm state, kept between runs
+        self.devices = [Device(dev_config) for dev_config in var.global_config['devices']]
+        self.manager = multiprocessing.Manager()
+        self.process_pool = create_process_pool(set(c.get('client_type', 'Official') for c in var.personal_configs))
+
+    def request_run(self, accounts: list[str] | None, trigger: str) -> int:
+        self.runs.put({'accounts': accounts, 'trigger': trigger, 'requested_at': datetime.now().isoformat(timespec='seconds')})
+        self._logger.info(f'Run of {accounts or "every account"} queued by {trigger}')
+        return self.runs.qsize()
+
+    def post_runs(self, body, query):
+        accounts = body.get('accounts')
+        return 202, {'queued': self.request_run(accounts, 'api')}
+
+    def post_reload(self, body, query):
+        with self._lock:
+            var.personal_configs = read_config('personal')
+            var.config_templates = get_config_templates()
+        self._logger.info('Personal config and templates reloaded')
+        return 200, {'accounts': len(var.personal_configs)}
+
+    def get_status(self, body, query):
+        now = datetime.now()
+        return 200, {
+            'running': self.current,
+            'queued': list(self.runs.queue),
+            'schedules': [{**entry, 'next': (n.isoformat(timespec='minutes') if (n := schedule.next_after(now)) else None)} for schedule, entry in self.schedules],
+            'last_results': self.last_results
+        }
+
+    def routes(self) -> http_api.Routes:
+        return {
+            ('POST', '/runs'): self.post_runs,
+            ('POST', '/reload'): self.post_reload,
+            ('GET', '/status'): self.get_status
+        }
+
+    def run_once(self, request: dict):
+        var.start_time = datetime.now()
+        var.run_id = var.start_time.strftime('%Y-%m-%d-%H-%M-%S')
+        var.tasks = []
+        tracing.reset()
+        run_start_us = tracing.now_us()
+        # the clients may have been updated or reinstalled since the last run
+        for device in self.devices:
+            device.current_status.pop('packages', None)
+
+        accounts = request['accounts']
+        with self._lock:
+            personal_configs = [c for c in var.personal_configs if not accounts or f'{c.get("client_type", "Official")}{c.get("account_name", "")}' in accounts]
+            expand_tasks(personal_configs)
+        self._logger.info(f'Run {var.run_id} ({request["trigger"]}) with {len(var.tasks)} tasks')
+
+        journal = RunJournal(get_journal_file())
+        tasks = journal.started(var.run_id, var.start_time.timestamp(), var.tasks)
+        execute(LocalTaskSource(tasks, journal), run_start_us, self.devices, self.manager, self.process_pool)
+        journal.ended()
+        journal.close()
+        self.last_results[var.run_id] = {'trigger': request['trigger'], **send_report(journal.path)}
+
+    def serve_forever(self):
+        last_minute = None
+        while True:
+            minute = datetime.now().replace(second=0, microsecond=0)
+            if minute != last_minute:
+                for schedule, entry in self.schedules:
+                    if schedule.matches(minute):
+                        self.request_run(entry.get('accounts'), f'schedule {entry["cron"]}')
+                last_minute = minute
+            try:
+                request = self.runs.get(timeout=1)
+            except queue.Empty:
+                continue
+            self.current = request
+            try:
+                self.run_once(request)
+            except Exception as e:
+                self._logger.error(f'An unexpected error was occured when running: {e}', exc_info=True)
+            finally:
+                self.current = None
+
+    def stop(self):
+        if self.process_pool:
+            self.process_pool.stop()
+        self.manager.shutdown()
+
+
+def daemon():
+    config = get_daemon_config()
+    state = Daemon(config)
+    server = http_api.serve(state.routes(), config['host'], config['port'], 'daemon')
+    try:
+        state.serve_forever()
+    except KeyboardInterrupt:
+        logging.info('Daemon interrupted')
+    finally:
+        server.shutdown()
+        state.stop()
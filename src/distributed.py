@@ -0,0 +1,183 @@
+'''
+Running one set of tasks on many hosts: the coordinator owns the expanded tasks and leases them to workers,
+one per emulator host, over HTTP (see task_source.RemoteTaskSource). A lease is kept alive by the heartbeat of its worker,
+the tasks of a worker which stopped heartbeating are requeued. The coordinator reports the results of all hosts.
+
+    python main.py coordinator                              # distributed.port of global.yaml, default 8765
+    python main.py worker --coordinator http://host:8765    # or distributed.coordinator of global.yaml
+'''
+import logging
+import socket
+import threading
+import time
+
+import var
+import http_api
+import webhooks
+import game_day
+from maa_runner import expand_tasks, execute, send_report, get_journal_file
+from expansion import materialize_task
+from journal import RunJournal
+from task_source import RemoteTaskSource
+
+DEFAULT_DISTRIBUTED = {
+    # it serves task configs and takes results without authentication, listening on other interfaces is opt-in
+    'host': '127.0.0.1',
+    'port': 8765,
+    'coordinator': 'http://127.0.0.1:8765',
+    'lease_sec': 60,
+    'heartbeat_sec': 10,
+    'idle_timeout_sec': 600
+}
+
+
+def get_distributed_config() -> dict:
+    return {**DEFAULT_DISTRIBUTED, **var.global_config.get('distributed', {}), **var.mode_args}
+
+
+class Coordinator:
+    def __init__(self, tasks: list[dict], journal: RunJournal, lease_sec=60, idle_timeout_sec=600) -> None:
+        self.lease_sec = lease_sec
+        self.idle_timeout_sec = idle_timeout_sec
+        # since when tasks are queued but nothing is leased and no worker is active
+        self._idle_since: float | None = None
+        self.queue = list(tasks)
+        self.tasks = {task['hash']: task for task in tasks}
+        self.journal = journal
+        # hash: (worker, task, expiry)
+        self.leases: dict[str, tuple[str, dict, float]] = {}
+        self.workers: dict[str, float] = {}
+        self._completed: set[str] = set()
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger('coordinator')
+
+    def _seen(self, worker):
+        self.workers[worker] = time.monotonic()
+
+    def requeue_expired(self):
+        with self._lock:
+            now = time.monotonic()
+            for task_hash, (worker, task, expiry) in list(self.leases.items()):
+                if expiry < now:
+                    self._logger.warning(f'Lease of task {task_hash} on worker {worker} expired, requeued')
+                    del self.leases[task_hash]
+                    self.queue.insert(0, task)
+
+    def get_tasks(self, body, query):
+        self.requeue_expired()
+        with self._lock:
+            self._seen(query.get('worker', ''))
+            return 200, {'queued': self.queue, 'leased': len(self.leases)}
+
+    def lease(self, body, query):
+        with self._lock:
+            self._seen(body['worker'])
+            task = next((task for task in self.queue if task['hash'] == body['hash']), None)
+            if task is None:
+                return 200, {'ok': False}
+            self.queue.remove(task)
+            self.leases[task['hash']] = (body['worker'], task, time.monotonic() + self.lease_sec)
+            self._logger.info(f'Task {task["hash"]} leased to worker {body["worker"]}')
+            return 200, {'ok': True, 'lease_sec': self.lease_sec}
+
+    def heartbeat(self, body, query):
+        with self._lock:
+            self._seen(body['worker'])
+            lost = []
+            for task_hash in body['hashes']:
+                lease = self.leases.get(task_hash)
+                if lease and lease[0] == body['worker']:
+                    self.leases[task_hash] = (lease[0], lease[1], time.monotonic() + self.lease_sec)
+                else:
+                    lost.append(task_hash)
+            return 200, {'lost': lost}
+
+    def result(self, body, query):
+        with self._lock:
+            self._seen(body['worker'])
+            task_hash = body['hash']
+            task = self.tasks[task_hash]
+            if task_hash in self._completed:
+                self._logger.warning(f'Task {task_hash} was already completed, result of worker {body["worker"]} ignored')
+                return 200, {'ok': False}
+            self._completed.add(task_hash)
+            self.journal.result(task_hash, body['result'])
+            game_day.get_dedupe().record(task, body['result'])
+            self.leases.pop(task_hash, None)
+            # a requeued task may have been finished by its first worker after all
+            self.queue = [task for task in self.queue if task['hash'] != task_hash]
+            self._logger.info(f'Task {task_hash} finished on worker {body["worker"]}')
+            return 200, {'ok': True}
+
+    def bye(self, body, query):
+        with self._lock:
+            self.workers.pop(body['worker'], None)
+            self._logger.info(f'Worker {body["worker"]} left')
+            return 200, {}
+
+    def finished(self) -> bool:
+        '''
+        Every task has a result, or tasks are queued but nothing was leased and no worker was active for idle_timeout_sec
+        (tasks pinned to devices no worker has, workers which did not come back). Those are failed by abandon
+        '''
+        with self._lock:
+            if not self.queue and not self.leases:
+                return True
+            now = time.monotonic()
+            active = [worker for worker, last_seen in self.workers.items() if now - last_seen < self.lease_sec]
+            if self.leases or active:
+                self._idle_since = None
+                return False
+            if self._idle_since is None:
+                self._idle_since = now
+            return now - self._idle_since >= self.idle_timeout_sec
+
+    def abandon(self):
+        '''
+        Fail the tasks left in the queue
+        '''
+        with self._lock:
+            for task in self.queue:
+                self._logger.error(f'Task {task["hash"]} was not taken by any worker in {self.idle_timeout_sec}s, abandoned')
+                self._completed.add(task['hash'])
+                self.journal.result(task['hash'], {'task': task['hash'], 'exec_result': {'succeed': False, 'reason': 'Not taken by any worker', 'maatasks': []}})
+            self.queue = []
+
+    def routes(self) -> http_api.Routes:
+        return {
+            ('GET', '/tasks'): self.get_tasks,
+            ('POST', '/lease'): self.lease,
+            ('POST', '/heartbeat'): self.heartbeat,
+            ('POST', '/result'): self.result,
+            ('POST', '/bye'): self.bye
+        }
+
+
+def coordinator():
+    config = get_distributed_config()
+    expand_tasks()
+    journal = RunJournal(get_journal_file())
+    tasks = journal.started(var.run_id, var.start_time.timestamp(), var.tasks)
+    # leased as json
+    state = Coordinator([materialize_task(task) for task in tasks], journal, config['lease_sec'], config['idle_timeout_sec'])
+    server = http_api.serve(state.routes(), config['host'], config['port'], 'coordinator')
+    logging.info(f'Coordinating {len(var.tasks)} tasks')
+    while not state.finished():
+        time.sleep(1)
+        state.requeue_expired()
+    state.abandon()
+    server.shutdown()
+    journal.ended()
+    journal.close()
+    send_report(journal.path)
+
+
+def worker():
+    config = get_distributed_config()
+    worker_id = config.get('id') or f'{socket.gethostname()}-{var.run_id}'
+    aliases = [dev_config['alias'] for dev_config in var.global_config['devices']]
+    source = RemoteTaskSource(config['coordinator'], worker_id, aliases, config['heartbeat_sec'])
+    logging.info(f'Working for {config["coordinator"]} as {worker_id}')
+    tasks_run = execute(source)
+    logging.info(f'{tasks_run} tasks were run on this host')
+    webhooks.flush()
@@ -0,0 +1,100 @@
+'''
+Structural sharing for task expansion: the maatask configs of a template are frozen once (read-only mappings and tuples)
+and shared by the tasks of every account, a task keeps only what differs for its account (overrides, evaluated cases,
+StartUp account, chosen stage) in a ChainMap over the template config. Tasks become plain dicts again (materialize_task)
+when they leave the runner: when dispatched to a task process, or sent to a worker.
+'''
+import functools
+from collections.abc import Mapping
+from datetime import datetime
+from types import MappingProxyType
+
+import var
+from utils import in_game_time
+
+# template name: (the template it was frozen from, its frozen maatasks)
+_frozen_templates: dict[str, tuple[list, tuple[tuple[str, Mapping], ...]]] = {}
+
+
+def freeze(value):
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+def frozen_template(template_name) -> tuple[tuple[str, Mapping], ...]:
+    '''
+    (task_name, task_config) of every maatask of a template, frozen on first use. Reloaded templates are frozen again
+    '''
+    template = var.config_templates[template_name]
+    cached = _frozen_templates.get(template_name)
+    if cached is None or cached[0] is not template:
+        cached = _frozen_templates[template_name] = (template, tuple((maatask['task_name'], freeze(maatask['task_config'])) for maatask in template))
+    return cached[1]
+
+
+@functools.lru_cache(maxsize=256)
+def compile_case(case: str):
+    return compile(case, '<case>', 'eval')
+
+
+def case_locals(server) -> dict:
+    '''
+    Names available to the case expressions of configs, for the current minute
+    '''
+    return _case_locals(server, datetime.now().strftime('%Y-%m-%d %H:%M'))
+
+
+@functools.lru_cache(maxsize=16)
+def _case_locals(server, minute) -> dict:
+    def time_between(time_start, time_end):
+        current_time = datetime.now().strftime('%H:%M')
+        start_time_obj = datetime.strptime(time_start, '%H:%M')
+        end_time_obj = datetime.strptime(time_end, '%H:%M')
+        current_time_obj = datetime.strptime(current_time, '%H:%M')
+        return start_time_obj <= current_time_obj <= end_time_obj
+
+    def date_between(date_start, date_end):
+        current_date = datetime.now().strftime('%Y-%m-%d')
+        start_date_obj = datetime.strptime(date_start, '%Y-%m-%d')
+        end_date_obj = datetime.strptime(date_end, '%Y-%m-%d')
+        current_date_obj = datetime.strptime(current_date, '%Y-%m-%d')
+        return start_date_obj <= current_date_obj <= end_date_obj
+
+    def datetime_between(datetime_start, datetime_end):
+        current_datetime = datetime.now()
+        start_datetime_obj = datetime.strptime(datetime_start, '%Y-%m-%d %H:%M:%S')
+        end_datetime_obj = datetime.strptime(datetime_end, '%Y-%m-%d %H:%M:%S')
+        return start_datetime_obj <= current_datetime <= end_datetime_obj
+
+    AM = in_game_time(datetime.now(), server).hour < 12
+    weekday = datetime.now().weekday()
+    # excuted_time_in_cur_gameday =
+
+    return MappingProxyType(locals().copy())
+
+
+def materialize_task(task: dict) -> dict:
+    '''
+    The task with plain dicts and lists only, to be pickled or serialized
+    '''
+    return {**task, 'task': [{'task_name': maatask['task_name'], 'task_config': thaw(maatask['task_config'])} for maatask in task['task']]}
+
+
+def to_json(value):
+    '''
+    default of json.dumps for tasks which are not materialized
+    '''
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
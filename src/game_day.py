@@ -0,0 +1,77 @@
+'''
+Maatasks which only have value once per game day (the day of the server, reset at 04:00, see utils.in_game_time):
+once one succeeded for an account, later runs of the same game day leave it out of the task of that account.
+The succeeded ones are remembered in Data/Cache/game_day.json, with their duration, which is reported as device time saved.
+'''
+import logging
+import threading
+from datetime import datetime
+
+import var
+from utils import in_game_time, read_json, write_json
+from journal import RERUN_MAATASKS
+
+DEFAULT_ONCE_PER_GAME_DAY = ['Award', 'Mall', 'Recruit']
+
+
+def get_game_day(server, time: datetime | None = None) -> str:
+    return in_game_time(time or datetime.now(), server).strftime('%Y-%m-%d')
+
+
+class GameDayDedupe:
+    def __init__(self, path, maatask_names: list[str]) -> None:
+        self.path = path
+        self.maatask_names = maatask_names
+        # task hash: {'game_day': ..., 'maatasks': {name: duration}}
+        self.done: dict[str, dict] = {}
+        # results reach the coordinator on the threads of its http server
+        self._lock = threading.Lock()
+        if path.exists():
+            try:
+                self.done = read_json(path)
+            except Exception as e:
+                logging.warning(f'Failed to read {path}, every maatask is run: {e}')
+
+    def _done_today(self, task_hash, server) -> dict[str, float]:
+        entry = self.done.get(task_hash)
+        if entry and entry['game_day'] == get_game_day(server):
+            return entry['maatasks']
+        return {}
+
+    def trim(self, task: dict) -> dict:
+        '''
+        Leave out the maatasks of task which succeeded in this game day, they are listed in task['skipped'] with their last duration.
+        When only StartUp would be left, nothing is
+        '''
+        with self._lock:
+            done = self._done_today(task['hash'], task['server'])
+        skipped = [{'task_name': maatask['task_name'], 'duration': done[maatask['task_name']]}
+                   for maatask in task['task'] if maatask['task_name'] in done]
+        if skipped:
+            logging.info(f'Task {task["hash"]} skips {[s["task_name"] for s in skipped]}, done in this game day')
+        task['task'] = [maatask for maatask in task['task'] if maatask['task_name'] not in done]
+        if skipped and all(maatask['task_name'] in RERUN_MAATASKS for maatask in task['task']):
+            task['task'] = []
+        task['skipped'] = skipped
+        return task
+
+    def record(self, task: dict, result: dict | None):
+        if not result:
+            return
+        with self._lock:
+            done = self._done_today(task['hash'], task['server'])
+            for maatask in result['exec_result']['maatasks']:
+                if maatask['type'] in self.maatask_names and maatask['exec_result']['succeed']:
+                    done[maatask['type']] = maatask['duration']
+            self.done[task['hash']] = {'game_day': get_game_day(task['server']), 'maatasks': done}
+            write_json(self.path, self.done)
+
+
+_dedupe: GameDayDedupe | None = None
+
+
+def get_dedupe() -> GameDayDedupe:
+    global _dedupe
+    if _dedupe is None:
+        _dedupe = GameDayDedupe(var.cache_path / 'game_day.json', var.global_config.get('once_per_game_day', DEFAULT_ONCE_PER_GAME_DAY))
+    return _dedupe
@@ -0,0 +1,63 @@
+'''
+Minimal JSON over HTTP, for the coordinator of distributed runs and the daemon's trigger API
+'''
+import json
+import logging
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import urlsplit, parse_qs
+
+# (method, path): handler(body, query) -> (status, response)
+Routes = dict[tuple[str, str], Callable[[dict, dict], tuple[int, dict]]]
+
+
+def serve(routes: Routes, host, port, name) -> ThreadingHTTPServer:
+    logger = logging.getLogger(name)
+
+    class JsonHandler(BaseHTTPRequestHandler):
+        def _handle(self, method):
+            url = urlsplit(self.path)
+            handler = routes.get((method, url.path))
+            if handler is None:
+                self.send_error(404)
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                status, response = handler(body, query)
+            except Exception as e:
+                logger.error(f'An unexpected error was occured when handling {method} {url.path}: {e}', exc_info=True)
+                status, response = 500, {'error': str(e)}
+            data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, int(port)), JsonHandler)
+    threading.Thread(target=server.serve_forever, name=f'{name}-server', daemon=True).start()
+    logger.info(f'Listening at http://{host}:{port}')
+    return server
+
+
+def request(url, body: dict | None = None, timeout=10) -> dict:
+    '''
+    GET without a body, POST with one. Non 2xx answers raise urllib.error.HTTPError
+    '''
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data, {'Content-Type': 'application/json'} if data else {})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read() or b'{}')
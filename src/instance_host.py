@@ -0,0 +1,160 @@
+'''
+Multi-instance mode: one host process per client type loads MaaCore once and drives many devices,
+one thread and one Asst instance per task. Callbacks are routed to the right AsstProxy by their arg.
+'''
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import var
+import model
+import metrics
+import tracing
+from process_runner import run_task, instrumented_process
+
+
+def _run_hosted_task(process_static_params, process_shared_status):
+    device: model.Device = process_static_params['device']
+    task_hash = process_static_params['task']['hash']
+    logger = device.logger.getChild(f'instance({task_hash})')
+    # the track of the task in the trace, the stages of its thread are found by it
+    tracing.add_metadata(os.getpid(), f'instance({task_hash})', tid=threading.get_native_id(), task=task_hash, device=device.alias)
+    try:
+        run_task(process_static_params, process_shared_status, logger, isolated=False)
+    finally:
+        process_shared_status['finished'] = True
+
+
+def host_main(client_type, run_id, request_queue: multiprocessing.Queue, host_status):
+    var.run_id = run_id
+    logger = logging.getLogger(f'instancehost({client_type})')
+    with instrumented_process(f'instancehost({client_type})', host_status) as memory_sampler:
+        user_dir = var.maa_usrdir_path / f'instancehost_{client_type}'
+        user_dir.mkdir(exist_ok=True)
+        try:
+            with tracing.span('Asst.load'), metrics.timer('arkhelper_asst_load_duration_seconds', stage='resource'):
+                model.preload_resource(client_type, user_dir)
+            model.shared_userdir = True
+        except Exception as e:
+            # hosted tasks load by themselves then, one at a time (see model._asst_load_lock)
+            logger.error(f'Failed to preload resource: {e}', exc_info=True)
+
+        threads: list[threading.Thread] = []
+        while (request := request_queue.get()) is not None:
+            if request[0] == 'collect':
+                # a run ended: publish what it recorded here, the next run starts over
+                _, var.run_id, token = request
+                host_status['metrics'] = metrics.registry.dump()
+                metrics.reset()
+                host_status['trace'] = tracing.take()
+                if memory_sampler:
+                    memory_sampler.flush()
+                host_status['collected'] = token
+                continue
+            process_static_params, process_shared_status = request
+            thread = threading.Thread(target=_run_hosted_task, args=(process_static_params, process_shared_status), name=process_static_params['task']['hash'])
+            thread.start()
+            threads.append(thread)
+            threads = [t for t in threads if t.is_alive()]
+        [t.join() for t in threads]
+    logger.debug('Exited')
+
+
+class Host:
+    def __init__(self, client_type) -> None:
+        self.client_type = client_type
+        self.requests = multiprocessing.Queue()
+        self.status = multiprocessing.Manager().dict()
+        self.process = multiprocessing.Process(target=host_main, args=(client_type, var.run_id, self.requests, self.status))
+
+    def start(self):
+        self.process.start()
+
+    def stop(self):
+        self.requests.put(None)
+        self.process.join()
+
+    def collect(self, token, timeout=30) -> bool:
+        '''
+        Have the host publish the metrics, trace and memory timeline recorded since the last collect, for the current run
+        '''
+        self.requests.put(('collect', var.run_id, token))
+        deadline = time.time() + timeout
+        while self.status.get('collected') != token:
+            if not self.process.is_alive() or time.time() > deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+
+
+class HostedTask:
+    '''
+    The part of multiprocessing.Process the runner needs, for a task running as a thread of a host
+    '''
+
+    def __init__(self, host: Host, args) -> None:
+        self._host = host
+        self._args = args
+        self.pid = None
+
+    def start(self):
+        self.pid = self._host.process.pid
+        self._host.requests.put(self._args)
+
+    def kill(self):
+        '''
+        A thread cannot be killed, its host is: the other tasks of the host end without a result
+        '''
+        self._host.kill()
+
+    def is_alive(self) -> bool:
+        if not self._host.process.is_alive():
+            return False
+        return not self._args[1].get('finished', False)
+
+
+class HostPool:
+    def __init__(self) -> None:
+        self.hosts: dict[str, Host] = {}
+        self._collects = 0
+
+    def create_process(self, client_type, target, args):
+        if client_type not in self.hosts or not self.hosts[client_type].process.is_alive():
+            host = self.hosts[client_type] = Host(client_type)
+            host.start()
+        return HostedTask(self.hosts[client_type], args)
+
+    def collect(self):
+        '''
+        At the end of a run whose hosts are kept (daemon): merge what the hosts recorded during it into the runner's
+        '''
+        self._collects += 1
+        for host in self.hosts.values():
+            if host.process.is_alive() and host.collect(self._collects):
+                self._merge(host)
+            else:
+                logging.warning(f'Metrics and trace of instancehost({host.client_type}) are missing from this run')
+
+    def stop(self):
+        '''
+        Wait for the hosts to exit and merge their metrics and trace into the runner's
+        '''
+        for host in self.hosts.values():
+            host.stop()
+            self._merge(host)
+        self.hosts.clear()
+
+    @staticmethod
+    def _merge(host: Host):
+        source = f'instancehost({host.client_type})'
+        metrics.registry.set_live(source, host.status.get('metrics', {}))
+        metrics.registry.drop_live(source)
+        tracing.events.extend(host.status.get('trace', []))
+        host.status['metrics'], host.status['trace'] = {}, []
+        tracing.add_metadata(host.process.pid, source)
@@ -0,0 +1,146 @@
+'''
+Journal of a run: one json record per line, appended and fsync'd as the run goes, so that the results of the tasks
+which ended survive a crash of the runner. Reports are built by reading it back (iter_results), one record at a time.
+
+    {"type": "run", "run_id": ..., "start_time": ..., "resumed_from": ... | null}
+    {"type": "planned", "hash": ..., "task": {...}}       every task of the run as get_full_task made it, before any is started.
+                                                         task.skipped lists the maatasks left out by game_day
+    {"type": "maatask", "hash": ..., "maatask": {...}}   a maatask of a running task ended
+    {"type": "result", "hash": ..., "result": {...} | null}
+    {"type": "end", "end_time": ...}
+
+A run interrupted before its end can be resumed (`main.py run --resume`) from its journal, see resume_tasks.
+'''
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterator
+
+from expansion import to_json
+
+
+class RunJournal:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf8')
+        # results reach the coordinator on the threads of its http server
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=to_json) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def started(self, run_id, start_time: float, tasks: list[dict], resumed_from: Path | None = None) -> list[dict]:
+        '''
+        Return the tasks to run. Tasks without maatasks left (see game_day) are not, their results are written here
+        '''
+        self.write({'type': 'run', 'run_id': run_id, 'start_time': start_time, 'resumed_from': str(resumed_from) if resumed_from else None})
+        for task in tasks:
+            self.write({'type': 'planned', 'hash': task['hash'], 'task': task})
+        for task in tasks:
+            if not task['task']:
+                self.result(task['hash'], {'task': task['hash'], 'exec_result': {'succeed': True, 'reason': 'Done in this game day', 'maatasks': []}})
+        return [task for task in tasks if task['task']]
+
+    def maatask_ended(self, task_hash, maatask: dict):
+        self.write({'type': 'maatask', 'hash': task_hash, 'maatask': maatask})
+
+    def result(self, task_hash, result: dict | None):
+        self.write({'type': 'result', 'hash': task_hash, 'result': result})
+
+    def ended(self):
+        self.write({'type': 'end', 'end_time': time.time()})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_journal(path: Path) -> Iterator[dict]:
+    '''
+    The records of a journal. A last line cut by a crash is skipped
+    '''
+    with open(path, 'r', encoding='utf8') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f'Skipped a broken record of journal {path}')
+
+
+def iter_results(path: Path) -> Iterator[tuple[str, dict | None]]:
+    '''
+    (hash, result) of every planned task: tasks with a result in the order they ended, then the ones which never ended
+    with None. Only the hashes are kept in memory
+    '''
+    planned, ended = [], set()
+    for record in read_journal(path):
+        if record['type'] == 'planned':
+            planned.append(record['hash'])
+        elif record['type'] == 'result' and record['hash'] not in ended:
+            ended.add(record['hash'])
+            yield record['hash'], record['result']
+    for task_hash in planned:
+        if task_hash not in ended:
+            yield task_hash, None
+
+
+# rerun whenever anything after them is, the account has to be logged in again
+RERUN_MAATASKS = ['StartUp']
+
+
+def skipped_maatasks(path: Path) -> tuple[int, float]:
+    '''
+    Count and last known duration (seconds) of the maatasks game_day left out of the tasks of the run
+    '''
+    count, duration = 0, 0
+    for record in read_journal(path):
+        if record['type'] == 'planned':
+            skipped = record['task'].get('skipped', [])
+            count += len(skipped)
+            duration += sum(s['duration'] for s in skipped)
+    return count, duration
+
+
+def find_latest_journal(directory: Path) -> Path | None:
+    # named by start time, which sorts
+    journals = sorted(directory.glob('*.journal.jsonl'))
+    return journals[-1] if journals else None
+
+
+def resume_tasks(path: Path) -> list[dict]:
+    '''
+    The planned tasks of a journal without their succeeded maatasks, in plan order. Tasks with nothing left to run are dropped.
+    Maatasks are matched by position: a task process runs them, and reports them, in the order of the plan
+    '''
+    planned: dict[str, dict] = {}
+    ended: dict[str, list[dict]] = {}
+    for record in read_journal(path):
+        if record['type'] == 'planned':
+            planned[record['hash']] = record['task']
+        elif record['type'] == 'maatask':
+            ended.setdefault(record['hash'], []).append(record['maatask'])
+        elif record['type'] == 'result' and record['result']:
+            # a result of a task process which failed may list fewer maatasks than it journaled
+            if len(record['result']['exec_result']['maatasks']) >= len(ended.get(record['hash'], [])):
+                ended[record['hash']] = record['result']['exec_result']['maatasks']
+
+    tasks = []
+    for task_hash, task in planned.items():
+        done = [maatask['exec_result']['succeed'] for maatask in ended.get(task_hash, [])]
+        undone = [i for i in range(len(task['task'])) if not (i < len(done) and done[i])]
+        if all(task['task'][i]['task_name'] in RERUN_MAATASKS for i in undone):
+            logging.info(f'Task {task_hash} was finished')
+            continue
+        left = [maatask for i, maatask in enumerate(task['task']) if i in undone or maatask['task_name'] in RERUN_MAATASKS]
+        logging.info(f'Task {task_hash} is resumed with {[maatask["task_name"] for maatask in left]}')
+        # what was skipped is counted in the report of the run resumed from
+        tasks.append({**task, 'task': left, 'skipped': []})
+    return tasks
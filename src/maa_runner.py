@@ -1,25 +1,45 @@
 import var
+import metrics
+import tracing
+import memory_timeline
+import readiness
+import webhooks
+import game_day
+import admission
+import zygote
+import instance_host
 from utils import *
 from model import *
 from process_runner import start_task_process
+from task_source import LocalTaskSource
+from journal import RunJournal, iter_results, skipped_maatasks, find_latest_journal, resume_tasks
 from task_planner import *
+from expansion import frozen_template, compile_case, case_locals, materialize_task
 
 
 import logging
 import time
-import copy
+import collections
+import functools
 import multiprocessing
-import easywebhooker
+import psutil
+from typing import Iterable, Iterator
+from collections import ChainMap
+from collections.abc import Mapping
 from dataclasses import dataclass
 
 from indent_concluder import Item as ConcluderItem
 
 
-def do_conclusion():
-    file_name = r'%y-%m-%d-%H-%M-%S.json'
-    file_name = var.start_time.strftime(file_name)
+def get_conclusion_file(suffix='.json'):
+    file_name = r'%y-%m-%d-%H-%M-%S'
+    file_name = var.start_time.strftime(file_name) + suffix
 
-    file = var.cli_env / 'conclusion' / file_name
+    return var.cli_env / 'conclusion' / file_name
+
+
+def do_conclusion(summary: dict):
+    file = get_conclusion_file()
 
     def _get_conclusion():
         return {
@@ -27,7 +47,7 @@ def do_conclusion():
             'startTime': int(var.start_time.timestamp()*1000),
             'endTime': int(time.time()*1000),
             'code': 0,
-            'extra': {}
+            'extra': summary
         }
 
     file.parent.mkdir(exist_ok=True)
@@ -36,21 +56,100 @@ def do_conclusion():
     write_json(file, conclusion)
 
 
-def get_report(result):
-    final_conclusion = ConcluderItem('ArkHelperCLI Running')
-    for task_id, task_result in result.items():
+def get_report(results: Iterable[tuple[str, dict | None]]) -> Iterator[ConcluderItem]:
+    '''
+    One report item per task of results (see journal.iter_results), built as they are read
+    '''
+    for task_id, task_result in results:
         if task_result:
             item = ConcluderItem(task_id, task_result['exec_result']['succeed'], '')
             for maatask in task_result['exec_result']['maatasks']:
                 item.append(ConcluderItem(maatask['type'], maatask['exec_result']['succeed'], ', '.join(maatask['exec_result']['reason'])))
         else:
             item = ConcluderItem(task_id, False, 'Task failed to run')
-        final_conclusion.append(item)
-
-    return final_conclusion
+        yield item
+
+
+def get_journal_file():
+    return get_conclusion_file('.journal.jsonl')
+
+
+def write_trace():
+    trace_file = get_conclusion_file('.trace.json')
+    trace_file.parent.mkdir(exist_ok=True)
+    trace_events = tracing.dump()
+    tracing.write_trace(trace_file, trace_events)
+
+    summary = tracing.summarize(trace_events)
+    write_json(get_conclusion_file('.trace-summary.json'), summary)
+    logging.info(f'Trace is written to {trace_file}')
+    for device, utilization in summary.get('devices', {}).items():
+        logging.info(f'Device {device} utilization {utilization["utilization"]:.1%}, busy {utilization["busy_sec"]:.0f}s, idle {utilization["idle_sec"]:.0f}s, {utilization["tasks"]} tasks')
+    if summary:
+        logging.info(f'Critical path is on device {summary["critical_device"]}, makespan {summary["makespan_sec"]:.0f}s')
+
+
+def expand_tasks(personal_configs: list[dict] | None = None):
+    with tracing.span('expand tasks', cat='runner', tid=0):
+        dedupe = game_day.get_dedupe()
+        hash_counts = collections.Counter()
+        [var.tasks.append(dedupe.trim(get_full_task(personal_config, hash_counts))) for personal_config in (var.personal_configs if personal_configs is None else personal_configs)]
+
+
+def prestart_zygotes(servers):
+    '''
+    With fork_server, fork the zygotes before the CLI starts any thread, the first create_process_pool takes them over
+    '''
+    if not var.global_config.get('multi_instance', False) and var.global_config.get('fork_server', False) and zygote.is_supported():
+        var.zygote_pool = zygote.ZygotePool()
+        var.zygote_pool.prestart(servers)
+
+
+def create_process_pool(servers) -> 'instance_host.HostPool | zygote.ZygotePool | None':
+    if var.global_config.get('multi_instance', False):
+        return instance_host.HostPool()
+    elif var.global_config.get('fork_server', False):
+        if var.zygote_pool:
+            process_pool, var.zygote_pool = var.zygote_pool, None
+            process_pool.prestart(servers)
+            return process_pool
+        if zygote.is_supported():
+            process_pool = zygote.ZygotePool()
+            process_pool.prestart(servers)
+            return process_pool
+        else:
+            logging.warning('fork_server is only supported on Linux 5.3+ (fork and pidfd), ignored')
+    return None
 
 
 def run():
+    run_start_us = tracing.now_us()
+    resumed_from = None
+    if resume := var.mode_args.get('resume'):
+        resumed_from = find_latest_journal(get_journal_file().parent) if resume == 'latest' else Path(resume)
+        if resumed_from is None:
+            raise Exception('No journal to resume from')
+        logging.info(f'Resuming the run of journal {resumed_from}')
+        var.tasks = resume_tasks(resumed_from)
+    else:
+        expand_tasks()
+    # a new journal, the one resumed from is kept as it is
+    journal = RunJournal(get_journal_file())
+    tasks = journal.started(var.run_id, var.start_time.timestamp(), var.tasks, resumed_from)
+    execute(LocalTaskSource(tasks, journal), run_start_us)
+    journal.ended()
+    journal.close()
+    send_report(journal.path)
+
+
+def execute(source: LocalTaskSource, run_start_us=None, devices: list[Device] | None = None, manager=None, process_pool=None) -> int:
+    '''
+    Distribute the tasks of source (LocalTaskSource or task_source.RemoteTaskSource) to the devices of this host
+    until none is left for them, return how many were run here. Their results go to source.done.
+    devices, manager (multiprocessing.Manager) and process_pool are created for this call and dropped after it unless passed in,
+    which the daemon does to keep them warm between runs
+    '''
+    run_start_us = run_start_us or tracing.now_us()
     # update_nav()
     if var.global_config.get('restart_adb', False):
         ADB().exec_adb_cmd(['kill-server', 'start-server'])
@@ -63,26 +162,146 @@ def run():
         process_static_params: dict | None
         process_shared_status: dict | None
         finished: bool
-
-    [var.tasks.append(get_full_task(personal_config)) for personal_config in var.personal_configs]
-    devices = [Device(dev_config) for dev_config in var.global_config['devices']]
-    statuses: list[DeviceStatus] = [DeviceStatus(_device, None, None, None, False) for _device in devices]
-    running_result = {task.get('hash'): None for task in var.tasks}
+        process_start_time: float = 0
+        busy_time: float = 0
+        trace_tid: int = 0
+        last_end_us: int = 0
+        launched_at: float = 0
+        maatasks_reported: int = 0
+        delayed_by: str | None = None
+        killed_by_watchdog: bool = False
+
+    devices = devices or [Device(dev_config) for dev_config in var.global_config['devices']]
+    manager = manager or multiprocessing.Manager()
+    statuses: list[DeviceStatus] = [DeviceStatus(_device, None, None, None, False, trace_tid=i+1, last_end_us=run_start_us) for i, _device in enumerate(devices)]
+    tracing.add_metadata(os.getpid(), 'runner')
+    [tracing.add_metadata(os.getpid(), str(_status.device), tid=_status.trace_tid) for _status in statuses]
+    tasks_run = 0
+    source.refresh()
     device_count_limit = var.global_config.get('devices_running_limit', 10)
-
-    ...
+    # native calls (Asst.load, Asst.connect) have no timeout, a task stuck in one is killed after this long
+    task_deadline = var.global_config.get('max_task_waiting_time', 3600) + var.global_config.get('task_watchdog_grace', 600)
+    prelaunch_config = var.global_config.get('prelaunch', {})
+    prober = readiness.ReadinessProber()
+    admission_control = admission.AdmissionController(admission.get_admission_config(), var.cache_path / 'peak_rss.json')
+    run_start_time = time.time()
+    own_process_pool = process_pool is None
+    if own_process_pool:
+        process_pool = create_process_pool(set(task['server'] for task in source.queued()))
+    if metrics_port := var.global_config.get('metrics_port'):
+        metrics.start_server(metrics_port, var.global_config.get('metrics_host', '127.0.0.1'))
+
+    def update_metrics():
+        now = time.time()
+        metrics.set_gauge('arkhelper_task_queue_depth', len(source.queued()))
+        metrics.set_gauge('arkhelper_devices_running', len([_status for _status in statuses if _status.process != None]))
+        for _status in statuses:
+            busy_time = _status.busy_time
+            if _status.process != None:
+                busy_time += now - _status.process_start_time
+                metrics.registry.set_live(_status.process_static_params['task']['hash'], _status.process_shared_status.get('metrics', {}))
+                report_maatasks(_status, _status.process_shared_status.get('maatasks', []))
+            metrics.set_gauge('arkhelper_device_utilization_ratio', busy_time / max(now - run_start_time, 1), device=_status.device.alias)
+
+    def report_maatasks(status: DeviceStatus, maatasks: list[dict]):
+        '''
+        Journal the maatasks the task process finished since the last call, emit maatask-failed for the failed ones
+        '''
+        task = status.process_static_params['task']
+        for maatask in maatasks[status.maatasks_reported:]:
+            source.maatask_ended(task['hash'], maatask)
+            if not maatask['exec_result']['succeed']:
+                webhooks.emit('maatask-failed', task=task['hash'], server=task['server'], device=status.device.alias,
+                              maatask=maatask['type'], reason=', '.join(maatask['exec_result']['reason']))
+        status.maatasks_reported = len(maatasks)
+
+    def has_memory_headroom():
+        available_mb = psutil.virtual_memory().available / 1024 ** 2
+        return available_mb >= prelaunch_config.get('min_available_memory_mb', 2048)
+
+    def next_task_of(device: Device, tasks: list[dict]) -> dict | None:
+        return ([task for task in tasks if task.get('device') == device.alias] or [task for task in tasks if task.get('device') is None] or [None])[0]
+
+    def launch_devices():
+        '''
+        Look ahead in the task queue and launch the emulators of the devices which get the next tasks.
+        Devices are launched for the free devices_running_limit slots, plus `ahead` more while the running ones are busy
+        (when there is memory to spare for them), so that they boot in the meantime.
+        Beyond `ahead` more than the running tasks, a device is launched only when admission would admit its task
+        after the tasks of the devices launched before it
+        '''
+        limit = device_count_limit + prelaunch_config.get('ahead', 1)
+        running = len([_status for _status in statuses if _status.process is not None])
+        waiting = [_status for _status in statuses if not _status.finished and _status.process is None and _status.device.launch_command]
+        launched = running + len([_status for _status in waiting if _status.launched_at])
+        tasks = list(source.queued())
+        pending = []
+        for _status in waiting:
+            if _status.launched_at and (task := next_task_of(_status.device, tasks)):
+                tasks.remove(task)
+                pending.append(task['hash'])
+        for _status in waiting:
+            if launched >= limit or not tasks:
+                break
+            if _status.launched_at or (task := next_task_of(_status.device, tasks)) is None:
+                continue
+            if launched >= device_count_limit and not has_memory_headroom():
+                logging.debug(f'Not enough available memory to prelaunch {_status.device}')
+                break
+            # booting emulators for tasks admission would delay only keeps it delaying
+            if launched >= max(running, admission_control.config['min_running']) + prelaunch_config.get('ahead', 1) \
+                    and (delay := admission_control.admit(task['hash'], launched, pending)):
+                logging.debug(f'Not launching {_status.device}, its task would be delayed for {delay[0]}: {delay[1]}')
+                break
+            tasks.remove(task)
+            pending.append(task['hash'])
+            _status.device.launch(process_table())
+            _status.launched_at = time.time()
+            prober.watch(_status.device)
+            launched += 1
 
     while True:
+        # taken at most once per pass, shared by every kill and launch in it
+        process_table = functools.cache(ProcessTable.snapshot)
+        source.refresh()
+        admission_control.sample()
         for status in statuses:
             if status.process != None:
+                if not status.killed_by_watchdog and time.time() - status.process_start_time > task_deadline and status.process.is_alive():
+                    status.device.logger.error(f'Task {status.process_static_params["task"]["hash"]} is still running after {task_deadline}s, killed')
+                    status.process.kill()
+                    status.killed_by_watchdog = True
                 if not status.process.is_alive():
                     task_hash = status.process_static_params["task"]["hash"]
                     status.device.logger.debug(f'TaskProcess {task_hash} ended, ready to clear')
-                    running_result[task_hash] = status.process_shared_status.get('result', None)
+                    task_result = status.process_shared_status.get('result', None)
+                    # a process which died without a result still published the maatasks it finished
+                    report_maatasks(status, task_result['exec_result']['maatasks'] if task_result else status.process_shared_status.get('maatasks', []))
+                    source.done(task_hash, task_result)
+                    admission_control.ended(task_hash)
+                    tasks_run += 1
+                    busy_time = time.time() - status.process_start_time
+                    reason = f'Killed by the watchdog after {task_deadline}s' if status.killed_by_watchdog else 'TaskProcess exited without a result'
+                    task_result = task_result or {'exec_result': {'succeed': False, 'reason': reason, 'maatasks': []}}
+                    webhooks.emit('task-finished', task=task_hash, server=status.process_static_params['task']['server'], device=status.device.alias,
+                                  succeed=task_result['exec_result']['succeed'], reason=task_result['exec_result']['reason'], duration=busy_time)
+                    status.busy_time += busy_time
+                    metrics.inc('arkhelper_device_busy_seconds_total', busy_time, device=status.device.alias)
+                    metrics.registry.set_live(task_hash, status.process_shared_status.get('metrics', {}))
+                    metrics.registry.drop_live(task_hash)
+                    status.last_end_us = tracing.now_us()
+                    process_start_us = int(status.process_start_time * 1_000_000)
+                    tracing.add_complete_event('task', process_start_us, status.last_end_us - process_start_us, 'device', tid=status.trace_tid, device=status.device.alias, task=task_hash)
+                    tracing.events.extend(status.process_shared_status.get('trace', []))
+                    # a hosted task names its thread by itself, its pid is the host's
+                    if not isinstance(status.process, instance_host.HostedTask):
+                        tracing.add_metadata(status.process.pid, f'taskprocess({task_hash})', task=task_hash, device=status.device.alias)
                     status.process = None
                     status.process_static_params = None
                     status.process_shared_status = None
 
+        launch_devices()
+
         def running_devices_count():
             return len([_status for _status in statuses if _status.process != None and not _status.finished])
 
@@ -97,62 +316,129 @@ def run():
 
                 if _running_devices_count < device_count_limit:
                     logger.debug(f'{_running_devices_count} devices is running. OK for this')
-                    logger.debug(f'Process is None, ready to distribute task')
+                    logger.debug('Process is None, ready to distribute task')
 
                     def no_task():
-                        logger.debug(f'No task to distribute. Ended')
+                        logger.debug('No task to distribute. Ended')
                         if status.device.kill_after_end:
-                            status.device.kill()
+                            status.device.kill(process_table())
+                            status.launched_at = 0
+                            prober.forget(status.device)
                         status.finished = True
-                    if var.tasks:
-                        distribute_task = (
-                            [task for task in var.tasks if task.get('device') == status.device.alias] or
-                            [task for task in var.tasks if task.get('device') is None] or
-                            [None]
-                        )[0]
-
-                        if distribute_task:
-                            var.tasks.remove(distribute_task)
-                            process_static_params = {
-                                'task': distribute_task,
-                                'device': status.device
-                            }
-                            process_shared_status = multiprocessing.Manager().dict()
+                    distribute_task = None
+                    if tasks := source.queued():
+                        if var.global_config.get('server_affinity', True):
+                            servers_running = collections.Counter(_status.process_static_params['task']['server'] for _status in statuses if _status.process is not None)
+                            distribute_task = pick_task(status.device.alias, status.device.current_status['server'], tasks, servers_running)
+                        else:
+                            distribute_task = next_task_of(status.device, tasks)
+
+                    if distribute_task:
+                        if status.device.launch_command and not status.launched_at:
+                            logger.debug('Device is not launched yet, task is kept in the queue')
+                            continue
+                        if not prober.is_ready(status.device):
+                            logger.debug('Device is not ready yet, task is kept in the queue')
+                            continue
+                        if delay := admission_control.admit(distribute_task['hash'], _running_devices_count):
+                            resource, reason = delay
+                            # once per delay of a device, every pass would flood the log
+                            (logger.debug if status.delayed_by == resource else logger.info)(f'Task {distribute_task["hash"]} is delayed for {resource}: {reason}')
+                            status.delayed_by = resource
+                            metrics.inc('arkhelper_admission_delays_total', resource=resource)
+                            continue
+                        status.delayed_by = None
+                        if not source.take(distribute_task):
+                            logger.debug(f'Task {distribute_task["hash"]} was taken by another host')
+                            continue
+                        process_static_params = {
+                            'task': materialize_task(distribute_task),
+                            'device': status.device,
+                            'run_id': var.run_id
+                        }
+                        process_shared_status = manager.dict()
+                        if process_pool:
+                            process = process_pool.create_process(distribute_task['server'], start_task_process, (process_static_params, process_shared_status, ))
+                        else:
                             process = multiprocessing.Process(target=start_task_process, args=(process_static_params, process_shared_status, ))
 
-                            status.process = process
-                            status.process_static_params = process_static_params
-                            status.process_shared_status = process_shared_status
-
-                            logger.debug(f'Ready to start a task process(task={distribute_task["hash"]})')
+                        status.process = process
+                        status.process_static_params = process_static_params
+                        status.process_shared_status = process_shared_status
+                        status.process_start_time = time.time()
+                        status.maatasks_reported = 0
+                        status.killed_by_watchdog = False
+                        process_start_us = int(status.process_start_time * 1_000_000)
+                        tracing.add_complete_event('idle', status.last_end_us, process_start_us - status.last_end_us, 'device', tid=status.trace_tid, device=status.device.alias)
+
+                        logger.debug(f'Ready to start a task process(task={distribute_task["hash"]})')
+                        with tracing.span('spawn', cat='device', tid=status.trace_tid, device=status.device.alias, task=distribute_task['hash']):
                             process.start()
-                        else:
-                            no_task()
-                    else:
+                        admission_control.started(distribute_task['hash'], None if isinstance(process, instance_host.HostedTask) else process.pid)
+                        webhooks.emit('task-started', task=distribute_task['hash'], server=distribute_task['server'], device=status.device.alias)
+                    elif source.exhausted():
                         no_task()
 
+        update_metrics()
+
         if all([_status.finished for _status in statuses]):
-            logging.debug(f'All devices ended. Ready to exit')
+            logging.debug('All devices ended. Ready to exit')
             break
         else:
             time.sleep(2)
 
-    report = get_report(running_result)
-    succeed = report.succeed
-    report = '\n'.join([_r.failed_markdown() for _r in report.children])
+    prober.stop()
+    admission_control.save()
+    source.close()
+    if process_pool and own_process_pool:
+        process_pool.stop()
+    elif isinstance(process_pool, instance_host.HostPool):
+        process_pool.collect()
+
+    tracing.add_complete_event('run', run_start_us, tracing.now_us() - run_start_us, 'runner', tid=0)
+    if var.global_config.get('trace', True):
+        write_trace()
+    if var.global_config.get('memory_timeline'):
+        memory_timeline.summarize()
+    return tasks_run
+
+
+def send_report(journal_file: Path) -> dict:
+    '''
+    Write the conclusion and send the report webhooks, reading the results from the journal of the run.
+    Only the failed tasks are kept in memory. Return the summary of the conclusion
+    '''
+    summary = {'tasks': 0, 'succeed': 0, 'failed': []}
+    failed_markdowns = []
+    for item in get_report(iter_results(journal_file)):
+        summary['tasks'] += 1
+        if item.succeed:
+            summary['succeed'] += 1
+        else:
+            summary['failed'].append(item.name)
+            failed_markdowns.append(item.failed_markdown())
+    summary['skipped_maatasks'], summary['saved_sec'] = skipped_maatasks(journal_file)
+    do_conclusion(summary)
+
+    succeed = not summary['failed']
+    report = '\n'.join(failed_markdowns)
+    if summary['skipped_maatasks']:
+        report += f"\n\n{summary['skipped_maatasks']} maatasks done earlier in this game day were skipped, saving {summary['saved_sec'] / 60:.0f} min of device time"
     report = \
         f"""{report}
 
 {var.start_time.strftime('%Y-%m-%d %H:%M:%S')} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
-    easywebhooker.configure(var.global_config.get('webhook', []))
-    if not succeed:
-        easywebhooker.webhook('run-failed', report=report)
-    else:
-        easywebhooker.webhook('run-succeed', report=report)
-    easywebhooker.webhook('run-finished', report=report)
+    webhooks.emit('run-succeed' if succeed else 'run-failed', report=report)
+    webhooks.emit('run-finished', report=report)
+    webhooks.flush()
+    return summary
 
 
-def get_full_task(config: dict):
+def get_full_task(config: dict, hash_counts: collections.Counter):
+    '''
+    The task of an account. Its maatask configs are ChainMaps of what this account changes over the frozen template configs,
+    shared by every account of the template (see expansion). hash_counts counts the tasks of each hash expanded so far, to suffix duplicates
+    '''
     final_maatasks: list = []
     overrides = config.get('override', {})
     server = config.get('client_type', 'Official')
@@ -161,87 +447,51 @@ def get_full_task(config: dict):
     hash = f'{server}{account_name}'
     device = var.global_config.get('task-device', {}).get(hash, None)
 
-    template = var.config_templates[template_name]
-    for maatask in template:
-        final_task_config: dict = copy.deepcopy(maatask['task_config'])
-        final_task_name = copy.deepcopy(maatask['task_name'])
-
+    names = case_locals(server)
+
+    def match_case(config):
+        try:
+            for case in config:
+                case_config = config[case]
+                if case.replace(' ', '') in ['', 'default']:
+                    case = 'True'
+                case_eval = eval(compile_case(case), {}, dict(names))
+                if type(case_eval) != bool:
+                    raise Exception()
+                if case_eval:
+                    return case_config
+        except:
+            return config
+
+    for final_task_name, template_task_config in frozen_template(template_name):
         preference_task_config = overrides.get(final_task_name, {})
+        # the overrides are shared too, changes only has what is evaluated for this account
+        maps = [preference_task_config, template_task_config] if preference_task_config else [template_task_config]
+        final_task_config = ChainMap(*maps)
+        changes = {key: match_case(value) for key, value in {**template_task_config, **preference_task_config}.items() if isinstance(value, Mapping)}
 
-        def update_and_match_case():
-            nonlocal final_task_config
-            final_task_config.update(preference_task_config)
-
-            def get_config(key):
-                nonlocal final_task_config
-                config = final_task_config[key]
-
-                def aval_expression():
-                    def time_between(time_start, time_end):
-                        current_time = datetime.now().strftime('%H:%M')
-                        start_time_obj = datetime.strptime(time_start, '%H:%M')
-                        end_time_obj = datetime.strptime(time_end, '%H:%M')
-                        current_time_obj = datetime.strptime(current_time, '%H:%M')
-                        return start_time_obj <= current_time_obj <= end_time_obj
-
-                    def date_between(date_start, date_end):
-                        current_date = datetime.now().strftime('%Y-%m-%d')
-                        start_date_obj = datetime.strptime(date_start, '%Y-%m-%d')
-                        end_date_obj = datetime.strptime(date_end, '%Y-%m-%d')
-                        current_date_obj = datetime.strptime(current_date, '%Y-%m-%d')
-                        return start_date_obj <= current_date_obj <= end_date_obj
-
-                    def datetime_between(datetime_start, datetime_end):
-                        current_datetime = datetime.now()
-                        start_datetime_obj = datetime.strptime(datetime_start, '%Y-%m-%d %H:%M:%S')
-                        end_datetime_obj = datetime.strptime(datetime_end, '%Y-%m-%d %H:%M:%S')
-                        return start_datetime_obj <= current_datetime <= end_datetime_obj
-
-                    AM = in_game_time(datetime.now(), server).hour < 12
-                    weekday = datetime.now().weekday()
-                    # excuted_time_in_cur_gameday =
-
-                    return locals().copy()
-
-                if type(config) == dict:
-                    try:
-                        for case in config:
-                            case_config = config[case]
-                            if case.replace(' ', '') in ['', 'default']:
-                                case = 'True'
-                            case_eval = eval(case, {}, aval_expression())
-                            if type(case_eval) != bool:
-                                raise Exception()
-                            if case_eval:
-                                return case_config
-                            else:
-                                continue
-                    except:
-                        return config
-                else:
-                    return config
-            final_task_config = {key: get_config(key) for key in final_task_config}
-
-        def append():
-            if final_task_config.get('enable', True):
-                final_maatasks.append({
-                    'task_name': final_task_name,
-                    'task_config': final_task_config
-                })
-
-        update_and_match_case()
         if final_task_name == 'StartUp':
-            final_task_config['client_type'] = server
-            final_task_config['account_name'] = account_name
+            changes['client_type'] = server
+            changes['account_name'] = account_name
         elif final_task_name == 'Fight':
-            stage = final_task_config.get('stage')
-            if stage and type(stage) == dict:
-                final_task_config['stage'] = choice_stage(server, stage)
-        else:
-            pass
-        append()
-
-    if (index := len([t for t in var.tasks if t['hash'] == hash])) != 0:
+            stage = changes.get('stage', final_task_config.get('stage'))
+            if stage and isinstance(stage, Mapping):
+                # choice_stage reweights the dict it is given
+                changes['stage'] = choice_stage(server, dict(stage))
+
+        if changes:
+            final_task_config = ChainMap(changes, *maps)
+        elif len(maps) == 1:
+            final_task_config = template_task_config
+        if final_task_config.get('enable', True):
+            final_maatasks.append({
+                'task_name': final_task_name,
+                'task_config': final_task_config
+            })
+
+    index = hash_counts[hash]
+    hash_counts[hash] += 1
+    if index != 0:
         hash += f'_{index}'
 
     task = {
@@ -251,5 +501,6 @@ def get_full_task(config: dict):
         'server': server,
         'account_name': account_name
     }
-    logging.debug(f'Initialization ended for task {hash}: {task}')
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f'Initialization ended for task {hash}: {materialize_task(task)}')
     return task
@@ -1,7 +1,11 @@
 import var
 from utils import *
 from test_entrance import test
-from maa_runner import run
+from maa_runner import run, prestart_zygotes
+from distributed import coordinator, worker
+from daemon import daemon
+from profiling import run_profiled, aggregate
+import retention
 
 mode = init()
 
@@ -11,11 +15,15 @@ if __name__ == '__main__':
     logging.debug(f'With global config {var.global_config}')
     logging.debug(f'With config templates {var.config_templates}')
     logging.debug(f'With personal config {var.personal_configs}')
+    if mode in ('run', 'worker', 'daemon'):
+        prestart_zygotes(set(personal_config.get('client_type', 'Official') for personal_config in var.personal_configs))
+    retention.start()
 
     try:
         entrance = locals()[mode]
-        if var.verbose and False:
-            run_with_LineProfiler(entrance)
+        if var.profile:
+            run_profiled('runner', entrance)
+            aggregate()
         else:
             entrance()
 
@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+import psutil
+
+import var
+import tracing
+from utils import convert_str_to_legal_filename_windows, byte_to_MB, read_json, write_json
+
+
+def get_memory_dir():
+    return var.log_path / 'memory' / var.run_id
+
+
+class MemorySampler(threading.Thread):
+    '''
+    Sample RSS/USS of the current process at a fixed interval, tagged with the current tracing stage
+    '''
+
+    def __init__(self, name, interval=1.0, trace_malloc=False) -> None:
+        threading.Thread.__init__(self, name='memory-sampler', daemon=True)
+        self.task_name = name
+        self.interval = interval
+        self.trace_malloc = trace_malloc
+        self.samples: list[dict] = []
+        self._process = psutil.Process()
+        self._stop_event = threading.Event()
+        self._uss_available = True
+        self._first_snapshot = None
+
+    def sample(self):
+        # a multi-instance host has no stage on its main thread, its memory is shared by the stages of its hosted tasks
+        stage = tracing.current_stage() or '+'.join(tracing.open_stages()) or 'other'
+        rss, uss = None, None
+        if self._uss_available:
+            try:
+                info = self._process.memory_full_info()
+                rss, uss = info.rss, info.uss
+            except psutil.AccessDenied:
+                self._uss_available = False
+        if rss is None:
+            rss = self._process.memory_info().rss
+        sample = {'t': time.time(), 'stage': stage, 'rss': rss, 'uss': uss}
+        if self.trace_malloc:
+            sample['py_heap'] = tracemalloc.get_traced_memory()[0]
+        self.samples.append(sample)
+
+    def start(self):
+        if self.trace_malloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._first_snapshot = tracemalloc.take_snapshot()
+        threading.Thread.start(self)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sample()
+            except psutil.Error as e:
+                logging.debug(f'Memory sampling failed: {e}')
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> dict:
+        self._stop_event.set()
+        self.join(self.interval + 1)
+        return self.flush(final=True)
+
+    def flush(self, final=False) -> dict:
+        '''
+        Write the samples taken since the last flush into the memory dir of the current run and start over.
+        A multi-instance host of the daemon outlives runs, it flushes at the end of each
+        '''
+        self.sample()
+        samples, self.samples = self.samples, []
+
+        peak_by_stage = {}
+        for sample in samples:
+            peak = peak_by_stage.setdefault(sample['stage'], {'rss': 0, 'uss': 0})
+            peak['rss'] = max(peak['rss'], sample['rss'])
+            peak['uss'] = max(peak['uss'], sample['uss'] or 0)
+
+        result = {
+            'task': self.task_name,
+            'pid': os.getpid(),
+            'interval': self.interval,
+            'peak_rss': max(s['rss'] for s in samples),
+            'peak_by_stage': peak_by_stage,
+            'samples': samples
+        }
+
+        if final and self.trace_malloc and self._first_snapshot:
+            diff = tracemalloc.take_snapshot().compare_to(self._first_snapshot, 'lineno')
+            result['tracemalloc_diff'] = [str(stat) for stat in diff[:25]]
+            tracemalloc.stop()
+
+        memory_dir = get_memory_dir()
+        memory_dir.mkdir(parents=True, exist_ok=True)
+        write_json(memory_dir / f'{convert_str_to_legal_filename_windows(self.task_name)}-{os.getpid()}.json', result)
+        return result
+
+
+def summarize():
+    '''
+    Peak memory per stage over all task processes of this run, written to summary.json
+    '''
+    memory_dir = get_memory_dir()
+    results = [read_json(f) for f in memory_dir.glob('*.json') if f.name != 'summary.json']
+    if not results:
+        return None
+
+    stages = {}
+    for result in results:
+        for stage, peak in result['peak_by_stage'].items():
+            stage_summary = stages.setdefault(stage, {'max_rss': 0, 'max_uss': 0, 'rss_sum': 0, 'count': 0})
+            stage_summary['max_rss'] = max(stage_summary['max_rss'], peak['rss'])
+            stage_summary['max_uss'] = max(stage_summary['max_uss'], peak['uss'])
+            stage_summary['rss_sum'] += peak['rss']
+            stage_summary['count'] += 1
+
+    summary = {
+        'processes': len(results),
+        'peak_rss_by_task': {r['task']: r['peak_rss'] for r in results},
+        'stages': {
+            stage: {
+                'max_rss_mb': byte_to_MB(s['max_rss']),
+                'max_uss_mb': byte_to_MB(s['max_uss']),
+                'mean_peak_rss_mb': byte_to_MB(s['rss_sum'] / s['count'])
+            } for stage, s in stages.items()
+        }
+    }
+    write_json(memory_dir / 'summary.json', summary)
+    for stage, s in sorted(summary['stages'].items(), key=lambda i: -i[1]['max_rss_mb']):
+        logging.info(f'Memory of stage {stage}: peak RSS {s["max_rss_mb"]:.0f}MB, peak USS {s["max_uss_mb"]:.0f}MB, mean peak RSS {s["mean_peak_rss_mb"]:.0f}MB')
+    return summary
@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# name: (type, help, buckets)
+METRICS = {
+    'arkhelper_task_duration_seconds': ('histogram', 'Duration of a task (one account) by server and device', DURATION_BUCKETS),
+    'arkhelper_task_failures_total': ('counter', 'Tasks which did not succeed, by failure reason', None),
+    'arkhelper_maatask_duration_seconds': ('histogram', 'Duration of a maatask by type, device and server', DURATION_BUCKETS),
+    'arkhelper_maatask_retries_total': ('counter', 'Extra tries (tried_times - 1) spent on maatasks', None),
+    'arkhelper_maatask_failures_total': ('counter', 'Maatasks which did not succeed, by failure reason', None),
+    'arkhelper_adb_command_duration_seconds': ('histogram', 'Latency of adb commands by subcommand', DURATION_BUCKETS),
+    'arkhelper_asst_load_duration_seconds': ('histogram', 'Latency of Asst.load by stage', DURATION_BUCKETS),
+    'arkhelper_asst_connect_duration_seconds': ('histogram', 'Latency of AsstProxy.connect by device', DURATION_BUCKETS),
+    'arkhelper_asst_callbacks_total': ('counter', 'MaaCore callbacks received by message type', None),
+    'arkhelper_task_queue_depth': ('gauge', 'Tasks waiting to be distributed', None),
+    'arkhelper_devices_running': ('gauge', 'Devices which are running a task process', None),
+    'arkhelper_device_busy_seconds_total': ('counter', 'Seconds a device spent running task processes', None),
+    'arkhelper_device_utilization_ratio': ('gauge', 'Busy seconds of a device divided by the run time so far', None),
+    'arkhelper_emulator_launches_total': ('counter', 'Emulators started by the launch command of their device', None),
+    'arkhelper_admission_delays_total': ('counter', 'Times a task was delayed by admission control, by resource (memory, cpu)', None),
+    'arkhelper_webhook_deliveries_total': ('counter', 'Webhook requests by event and result (ok, rejected, failed after retries, error)', None),
+}
+
+
+def _key(name, labels: dict):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    '''
+    A process local metrics store. Snapshots (dump) are plain dicts so they can be passed through a multiprocessing.Manager
+    '''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values = {}
+        self._live = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._values.get(key)
+            if hist is None:
+                hist = self._values[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {key: (list(value) if type(value) == list else value) for key, value in self._values.items()}
+
+    def merge(self, snapshot: dict):
+        with self._lock:
+            self._merge_into(self._values, snapshot)
+
+    def set_live(self, source, snapshot: dict):
+        '''
+        Keep the latest snapshot of a running task process, it is exposed until drop_live
+        '''
+        with self._lock:
+            self._live[source] = snapshot
+
+    def drop_live(self, source, merge=True):
+        with self._lock:
+            snapshot = self._live.pop(source, None)
+            if merge and snapshot:
+                self._merge_into(self._values, snapshot)
+
+    @staticmethod
+    def _merge_into(target: dict, snapshot: dict):
+        for key, value in snapshot.items():
+            type_ = METRICS[key[0]][0]
+            if type_ == 'histogram':
+                hist = target.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    hist[i] += v
+            elif type_ == 'counter':
+                target[key] = target.get(key, 0) + value
+            else:
+                target[key] = value
+
+    def exposition(self) -> str:
+        values = self.dump()
+        with self._lock:
+            for snapshot in self._live.values():
+                self._merge_into(values, snapshot)
+
+        def label_str(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ''
+            escaped = [(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels]
+            return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+        lines = []
+        for name, (type_, help, buckets) in METRICS.items():
+            samples = sorted((labels, value) for (_name, labels), value in values.items() if _name == name)
+            if not samples:
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type_}')
+            for labels, value in samples:
+                if type_ == 'histogram':
+                    for bound, count in zip(buckets, value):
+                        lines.append(f'{name}_bucket{label_str(labels, [("le", str(bound))])} {count}')
+                    lines.append(f'{name}_bucket{label_str(labels, [("le", "+Inf")])} {value[-1]}')
+                    lines.append(f'{name}_sum{label_str(labels)} {value[-2]}')
+                    lines.append(f'{name}_count{label_str(labels)} {value[-1]}')
+                else:
+                    lines.append(f'{name}{label_str(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def reset():
+    '''
+    Drop everything inherited from the parent process. Call it at the start of a task process
+    '''
+    global registry
+    registry = Registry()
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    registry.set(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start, **labels)
+
+
+def reason_label(reason: str) -> str:
+    '''
+    Reasons may contain numbers (e.g. sanity), keep only the leading word to limit label cardinality
+    '''
+    return reason.split(':')[0].split('(')[0].strip() or 'Unknown'
+
+
+_server: ThreadingHTTPServer | None = None
+
+
+def start_server(port, host='127.0.0.1') -> ThreadingHTTPServer:
+    '''
+    Start serving /metrics once per process, later calls return the running server
+    '''
+    global _server
+    if _server:
+        return _server
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.getLogger('metrics').debug(format % args)
+
+    _server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f'Metrics are exposed at http://{host}:{port}/metrics')
+    return _server
@@ -11,26 +11,71 @@ from bs4 import BeautifulSoup
 from fake_useragent import UserAgent
 
 import var
+import metrics
+import tracing
+from readiness import get_readiness_config, wait_until_ready
+from retry import RetryPolicy, RetryError, call, run_subprocess
 from MAA.asst.asst import Asst
 from MAA.asst.utils import InstanceOptionType, Message, StaticOptionType
 from utils import *
 
 T = TypeVar('T', str, list[str])
 
+# a timed out command is killed (see retry.run_subprocess), a device which keeps timing out is not waited for again for a minute
+ADB_POLICY = RetryPolicy(attempts=2, backoff_base=0.5, retry_on=(subprocess.TimeoutExpired,), breaker='adb')
+# probes of a booting device are expected to time out, they are repeated by readiness instead and do not open the breaker
+ADB_PROBE_POLICY = RetryPolicy(attempts=1, retry_on=(subprocess.TimeoutExpired,))
+# in process and native, so a try cannot be cut: deadline_sec only stops retrying a load which failed slowly. A load hung in
+# MaaCore is ended by the watchdog of the runner, max_task_waiting_time + task_watchdog_grace after the task started (see retry.py)
+ASST_LOAD_POLICY = RetryPolicy(attempts=2, backoff_base=1, deadline_sec=300)
+ASST_LOAD_RESOURCE_POLICY = RetryPolicy(attempts=2, backoff_base=1, accept=bool, deadline_sec=300)
+
+# client type whose resources were loaded before the task started (see zygote.py and instance_host.py)
+preloaded_client_type: str | None = None
+# MaaCore has one user dir per process, a process running many instances keeps the one set when preloading
+shared_userdir = False
+# MaaCore loads one resource at a time in a process, hosted tasks (instance_host.py) load in threads of one
+_asst_load_lock = threading.Lock()
+
+
+def get_incremental_path(client_type: Optional[Union[str, None]] = None) -> pathlib.Path:
+    if client_type in ['Official', 'Bilibili', None]:
+        return var.maa_env / 'cache'
+    else:
+        return var.maa_env / 'resource' / 'global' / str(client_type)
+
+
+def preload_resource(client_type: Optional[Union[str, None]] = None, user_dir=None):
+    global preloaded_client_type
+    if not Asst.load(var.maa_env, get_incremental_path(client_type), user_dir):
+        raise Exception('Asst failed to load resource')
+    preloaded_client_type = client_type
+
 
 class ADB:
     def __init__(self, device: str = None) -> None:
         self.device = device
 
-    def exec_adb_cmd(self, cmd: T, each_timeout=None) -> T:
+    def exec_adb_cmd(self, cmd: T, each_timeout=None, policy=ADB_POLICY) -> T:
         type_of_cmd = type(cmd)
 
         if type_of_cmd == str:
-            return self._exec_adb_cmd(cmd, each_timeout)
+            return self._exec_adb_cmd(cmd, each_timeout, policy)
         if type_of_cmd == list:
-            return [self._exec_adb_cmd(c, each_timeout) for c in cmd]
-
-    def _exec_adb_cmd(self, cmd, timeout):
+            return [self._exec_adb_cmd(c, each_timeout, policy) for c in cmd]
+
+    def _breaker_key(self, cmd) -> str:
+        '''
+        The device a command talks to: its serial, the address of `connect`/`disconnect`, or the adb server itself
+        '''
+        if self.device:
+            return str(self.device)
+        words = cmd.split(' ')
+        if words[0] in ['connect', 'disconnect'] and len(words) > 1:
+            return words[1]
+        return 'server'
+
+    def _exec_adb_cmd_raw(self, cmd, timeout, policy=ADB_POLICY) -> tuple[bytes, bytes]:
         device = self.device
         final_cmd = var.global_config['adb_path']
         if device:
@@ -38,13 +83,11 @@ class ADB:
         final_cmd += f' {cmd}'
 
         logging.debug(f'Execing adb cmd: {final_cmd}')
-        proc = subprocess.Popen(
-            final_cmd,
-            stdin=None,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True)
-        outinfo, errinfo = proc.communicate(timeout=timeout)
+        with metrics.timer('arkhelper_adb_command_duration_seconds', command=cmd.split(' ')[0]):
+            return call(policy, run_subprocess, final_cmd, timeout, breaker_key=self._breaker_key(cmd))
+
+    def _exec_adb_cmd(self, cmd, timeout, policy=ADB_POLICY):
+        outinfo, errinfo = self._exec_adb_cmd_raw(cmd, timeout, policy)
         try:
             outinfo = outinfo.decode('utf-8')
         except:
@@ -60,13 +103,32 @@ class ADB:
 
     def get_game_version(self, game_type):
         package_name = arknights_package_name[game_type]
-        result = self.exec_adb_cmd(f'shell "pm dump {package_name} | grep versionName"', each_timeout=5)
-
-        return result.replace(' ', '').replace('versionName=', '').replace('\r\n', '')
+        result = self.exec_adb_cmd(f'shell "dumpsys package {package_name} | grep versionName"', each_timeout=5)
+
+        return result.replace(' ', '').replace('versionName=', '').replace('\r\n', '').strip()
+
+    def list_packages(self) -> dict[str, str | None]:
+        '''
+        {package: versionCode} of the installed packages, with one package manager query much lighter than dumping a package.
+        The versionCode is None on systems which do not support --show-versioncode
+        '''
+        packages = {}
+        for line in self.exec_adb_cmd('shell pm list packages --show-versioncode', each_timeout=10).splitlines():
+            if not line.startswith('package:'):
+                continue
+            package, _, version_code = line[len('package:'):].strip().partition(' versionCode:')
+            packages[package] = version_code or None
+        return packages
 
     def install(self, path):
         self.exec_adb_cmd(f'install {path}')
 
+    def screencap(self, timeout=10) -> bytes:
+        '''
+        PNG of the screen, streamed through exec-out instead of being written to the device storage
+        '''
+        return self._exec_adb_cmd_raw('exec-out screencap -p', timeout)[0]
+
 
 class Device:
     def __init__(self, dev_config) -> None:
@@ -78,6 +140,8 @@ class Device:
         self._port = dev_config['emulator_address'].split(':')[-1]
         self.kill_after_end = dev_config.get('kill_after_end', True)
         self._process = dev_config.get('process')
+        self.failure_snapshots = dev_config.get('failure_snapshots', var.global_config.get('failure_snapshots'))
+        self.launch_command = dev_config.get('launch')
         self.logger = logging.getLogger(str(self))
         self.current_status = multiprocessing.Manager().dict()
         self.current_status['server'] = None
@@ -92,7 +156,88 @@ class Device:
     def addr(self) -> str:
         return f'{self._host}:{self._port}'
 
-    def kill(self):
+    def get_packages(self) -> dict[str, dict]:
+        '''
+        {package: {'version_code', 'version_name'}} of the installed clients, kept in current_status so that the tasks of the device share it.
+        Filled by one `pm list packages` per run, the versionName of a client is only queried when its versionCode changed (see get_game_version).
+        Install drops it
+        '''
+        packages = self.current_status.get('packages')
+        if packages is None:
+            installed = self.adb.list_packages()
+            packages = {package: {'version_code': installed[package], 'version_name': None} for package in arknights_package_name.values() if package in installed}
+            self.current_status['packages'] = packages
+            self.logger.debug(f'Installed clients: {list(packages)}')
+        return packages
+
+    def is_installed(self, client_type) -> bool:
+        return arknights_package_name[client_type] in self.get_packages()
+
+    def get_game_version(self, client_type) -> str:
+        '''
+        versionName of the client, '' if it is not installed.
+        The versionName of every versionCode seen is kept in Data/Cache/client_versions/<adb serial>.json, the heavy
+        `dumpsys package` is only run when the client changed since (or without --show-versioncode)
+        '''
+        package = arknights_package_name[client_type]
+        packages = self.get_packages()
+        if package not in packages:
+            return ''
+        if packages[package]['version_name'] is None:
+            version_code = packages[package]['version_code']
+            # by serial, which names the emulator whatever its alias. Only written by the tasks of this device, which do not run at the same time
+            cache_file = var.cache_path / 'client_versions' / f'{convert_str_to_legal_filename_windows(self.adb.device)}.json'
+            known = read_json(cache_file) if cache_file.exists() else {}
+            if version_code is not None and package in known and known[package]['version_code'] == version_code:
+                version_name = known[package]['version_name']
+            else:
+                version_name = self.adb.get_game_version(client_type)
+                if version_code is not None and version_name:
+                    known[package] = {'version_code': version_code, 'version_name': version_name}
+                    cache_file.parent.mkdir(parents=True, exist_ok=True)
+                    write_json(cache_file, known)
+            packages[package]['version_name'] = version_name
+            # a manager dict only stores what is assigned to it
+            self.current_status['packages'] = packages
+        return packages[package]['version_name']
+
+    def install(self, path):
+        self.adb.install(path)
+        self.current_status.pop('packages', None)
+
+    def probe(self) -> bool:
+        '''
+        Cheap readiness check, much lighter than a MaaCore connect: adb answers for the device and Android finished booting
+        '''
+        state = self.adb.exec_adb_cmd('get-state', each_timeout=5, policy=ADB_PROBE_POLICY).strip()
+        if state != 'device':
+            # emulators listening on a tcp port are only known to adb once connected
+            ADB().exec_adb_cmd(f'connect {self.addr}', each_timeout=5, policy=ADB_PROBE_POLICY)
+            return False
+        return self.adb.exec_adb_cmd('shell getprop sys.boot_completed', each_timeout=5, policy=ADB_PROBE_POLICY).strip() == '1'
+
+    def is_launched(self, table: ProcessTable | None = None) -> bool:
+        '''
+        Whether something (the emulator, normally) is holding the adb port of the device
+        '''
+        return get_pid_by_port(self._port, table) is not None
+
+    def launch(self, table: ProcessTable | None = None) -> bool:
+        '''
+        Start the emulator with the launch command of the device without waiting for it to boot.
+        Return False if there is no launch command or the emulator is already running
+        '''
+        if not self.launch_command or self.is_launched(table):
+            return False
+        self.logger.info(f'Launching emulator: {self.launch_command}')
+        subprocess.Popen(self.launch_command, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        metrics.inc('arkhelper_emulator_launches_total', device=self.alias)
+        return True
+
+    def kill(self, table: ProcessTable | None = None):
+        '''
+        table: a process table shared by the devices killed in the same pass, taken here if not given
+        '''
         self.logger.debug(f'Try to kill emulator')
 
         if type(self._process) == None:
@@ -102,8 +247,9 @@ class Device:
                 kill_processes_by_name(pim)
         elif type(self._process) == str:
             if self._process == 'mumu':
-                headless_pid = get_pid_by_port(self._port)
-                player_pid = get_MuMuPlayer_by_MuMuVMMHeadless(headless_pid)
+                table = table or ProcessTable.snapshot()
+                headless_pid = get_pid_by_port(self._port, table)
+                player_pid = get_MuMuPlayer_by_MuMuVMMHeadless(headless_pid, table)
                 kill_processes_by_pid(headless_pid)
                 kill_processes_by_pid(player_pid)
 
@@ -140,7 +286,7 @@ class DictProxy:
 
 class AsstProxy:
 
-    def __init__(self, id, last_logger: logging.Logger, device: Device, asst_callback: Asst.CallBackType) -> None: # type: ignore
+    def __init__(self, id, last_logger: logging.Logger, device: Device, asst_callback: Asst.CallBackType, callback_arg=None) -> None: # type: ignore
         self._proxy_id = id
         self._logger = last_logger.getChild(str(self))
         self.device = device
@@ -152,42 +298,49 @@ class AsstProxy:
         self.userdir: pathlib.Path = var.maa_usrdir_path / convert_str_to_legal_filename_windows(self._proxy_id)
         self.userdir.mkdir(exist_ok=True)
 
-        try_run(Asst.load, (var.maa_env, None, self.userdir), 2, 5, self._logger)
-        self.asst = Asst(asst_callback)
+        if preloaded_client_type is not None:
+            if not shared_userdir:
+                Asst.set_user_dir(self.userdir)
+        else:
+            with _asst_load_lock, tracing.span('Asst.load'), metrics.timer('arkhelper_asst_load_duration_seconds', stage='lib'):
+                call(ASST_LOAD_POLICY, Asst.load, var.maa_env, None, self.userdir, logger=self._logger)
+        self.asst = Asst(asst_callback, callback_arg)
         self.asst.set_instance_option(InstanceOptionType.touch_type, 'minitouch')
         # Asst.set_static_option(StaticOptionType.gpu_ocr, '0')
 
     def load_res(self, client_type: Optional[Union[str, None]] = None):
-        incr: pathlib.Path
-        if client_type in ['Official', 'Bilibili', None]:
-            incr = var.maa_env / 'cache'
-        else:
-            incr = var.maa_env / 'resource' / 'global' / str(client_type)
+        if preloaded_client_type is not None and preloaded_client_type == client_type:
+            self._logger.debug(f'Asst resource of {client_type} is preloaded')
+            return
 
+        incr = get_incremental_path(client_type)
         self._logger.debug(f'Start to load asst resource and lib from incremental path {incr}')
-        if not try_run(Asst.load, (var.maa_env, incr, self.userdir), 2, 5, self._logger)[0]:
-            raise Exception('Asst failed to load resource')
+        with _asst_load_lock, tracing.span('load_res', client_type=str(client_type)), metrics.timer('arkhelper_asst_load_duration_seconds', stage='resource'):
+            try:
+                call(ASST_LOAD_RESOURCE_POLICY, Asst.load, var.maa_env, incr, self.userdir, logger=self._logger)
+            except RetryError as e:
+                raise Exception(f'Asst failed to load resource: {e.__cause__}')
         self._logger.debug(f'Asst resource and lib loaded from incremental path {incr}')
 
     def connect(self):
+        with tracing.span('connect', device=self.device.alias), metrics.timer('arkhelper_asst_connect_duration_seconds', device=self.device.alias):
+            self._connect()
+
+    def _connect(self):
         if self.device.extras:
             Asst.set_connection_extras(**self.device.extras)
-        max_try_time = 50
-        for tried_time in range(max_try_time):
-            self._logger.debug(f'Connect emulator {tried_time}st/{max_try_time}trying')
-
-            if self.asst.connect(self.device._adb, self.device.addr, self.device.config_type):
-                self._logger.debug(f'Connected to emulator')
-                return
-            else:
-                self._logger.debug(f'Connect failed')
+        config = get_readiness_config()
+        with tracing.span('wait ready'):
+            if not wait_until_ready(self.device, config, logger=self._logger):
+                raise Exception('Emulator did not become ready')
 
-            # if not _execed_start:
-            #    self.device.kill_start()
-            #    _execed_start = True
-
-            time.sleep(2)
-        raise Exception('Connect emulator trying times reached the maximum')
+        # the device answers adb, so MaaCore is expected to connect at the first try
+        policy = RetryPolicy(attempts=3, backoff_base=config['backoff_base'], backoff_cap=config['backoff_cap'], accept=bool)
+        try:
+            call(policy, self.asst.connect, self.device._adb, self.device.addr, self.device.config_type, logger=self._logger)
+        except RetryError:
+            raise Exception('Connect emulator trying times reached the maximum')
+        self._logger.debug(f'Connected to emulator')
 
     def add_maatask(self, task_name, task_config):
         self._logger.debug(f'Ready to append task {task_name} to {self}')
@@ -216,6 +369,7 @@ class AsstProxy:
 
         i = 0
         max_try_time = 2
+        start_time = time.perf_counter()
 
         if type == 'Fight':
             stage = config['stage']
@@ -300,7 +454,7 @@ class AsstProxy:
             self._logger.info(f'Maatask {type} ended successfully beacuse of {reason_str}')
         else:
             self._logger.warning(f'Maatask {type} ended in failure beacuse of {reason_str}')
-        return MaataskRunResult(type, succeed, reason, i+1, time_remain)
+        return MaataskRunResult(type, succeed, reason, i+1, time_remain, time.perf_counter() - start_time)
 
     def __str__(self) -> str:
         return f'asstproxy({self._proxy_id})'
@@ -316,10 +470,11 @@ class MaataskRunResult:
         reason: str
         tried_times: int
 
-    def __init__(self, type, succeed, reason, tried_times, time_remain) -> None:
+    def __init__(self, type, succeed, reason, tried_times, time_remain, duration=0) -> None:
         self.type = type
         self.exec_result = MaataskRunResult.MaataskExecResult(succeed, reason, tried_times)
         self.time_remain = time_remain
+        self.duration = duration
 
     def dict(self):
         return {
@@ -329,7 +484,8 @@ class MaataskRunResult:
                 'reason': self.exec_result.reason,
                 'tried_times': self.exec_result.tried_times
             },
-            'time_remain': self.time_remain
+            'time_remain': self.time_remain,
+            'duration': self.duration
         }
 
 
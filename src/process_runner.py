@@ -1,59 +1,118 @@
+import itertools
 import pathlib
 import threading
 import time
 import logging
 import json
+from contextlib import contextmanager
 from typing import Optional, Union
 
+import metrics
+import tracing
+from profiling import Profiler
+from memory_timeline import MemorySampler
+from callback_journal import CallbackRecorder, get_journal_file
+from snapshots import FailureSnapshots
+from retry import RetryPolicy, RetryError, call
 from MAA.asst.asst import Asst
 from MAA.asst.utils import Message
 from model import *
 from utils import *
 
 
-logger: logging.Logger = None
-asstproxy: AsstProxy = None
-task: dict = None
-task_id = None
-process_str = None
+logger: logging.Logger = logging.getLogger('taskprocess')
+# AsstProxy and callback journal of every Asst instance in this process, keyed by the callback arg of the instance
+asstproxies: dict[int, AsstProxy] = {}
+callback_recorders: dict[int, CallbackRecorder] = {}
+_callback_args = itertools.count(1)
+# no timeout, a second try must not race a download which is still going (see retry.py)
+UPDATE_POLICY = RetryPolicy(attempts=2, backoff_base=5)
 
 
 @Asst.CallBackType
 def asst_callback(msg, details, arg):
     try:
-        try:
-            m = Message(msg)
-            d = json.loads(details.decode('utf-8'))
+        if recorder := callback_recorders.get(arg):
+            recorder.write(msg, details)
+        m = Message(msg)
+        d = json.loads(details.decode('utf-8'))
+        metrics.inc('arkhelper_asst_callbacks_total', msg=m.name)
+        if asstproxy := asstproxies.get(arg):
             asstproxy.process_callback(m, d, arg)
-        except NameError as e:
-            if e.name == 'asstproxy':
-                logger.debug(f'asstproxy was deleted when receiving callback: {e}')
-            else:
-                raise
+        else:
+            logger.debug(f'asstproxy {arg} was deleted when receiving callback')
     except Exception as e:
         logger.error(f'An unexpected error was occured when receiving callback: {e}', exc_info=True)
 
 
+@contextmanager
+def instrumented_process(name, process_shared_status):
+    '''
+    Process level instrumentation (metrics, trace, profile, memory timeline) of a task process or a multi-instance host.
+    Yield the memory sampler, None without memory_timeline
+    '''
+    metrics.reset()
+    tracing.reset()
+    profiler = None
+    if var.profile:
+        profiler = Profiler(name)
+        profiler.start()
+    memory_sampler = None
+    if memory_config := var.global_config.get('memory_timeline'):
+        memory_sampler = MemorySampler(name, memory_config.get('interval', 1), memory_config.get('tracemalloc', False))
+        memory_sampler.start()
+    try:
+        yield memory_sampler
+    finally:
+        process_shared_status['metrics'] = metrics.registry.dump()
+        process_shared_status['trace'] = tracing.dump()
+        if profiler:
+            profiler.stop()
+        if memory_sampler:
+            memory_sampler.stop()
+
+
 def start_task_process(process_static_params, process_shared_status):
-    global logger, task, task_id, process_str, asstproxy
+    global logger
 
+    device: Device = process_static_params['device']
+    var.run_id = process_static_params['run_id']
+    process_str = f'taskprocess({process_static_params["task"]["hash"]})'
+    logger = device.logger.getChild(process_str)
+    with instrumented_process(process_str, process_shared_status):
+        run_task(process_static_params, process_shared_status, logger)
+
+
+def run_task(process_static_params, process_shared_status, logger: logging.Logger, isolated=True):
+    '''
+    isolated: the task owns its process, so the process level metrics belong to it
+    '''
     device: Device = process_static_params['device']
     task = process_static_params['task']
     task_id = task['hash']
     client_type = task['server']
-    process_str = f'taskprocess({task_id})'
-    logger = device.logger.getChild(process_str)
+    # not var.run_id: the hosts of the daemon outlive runs and run the tasks of one in threads
+    run_id = process_static_params['run_id']
     logger.debug('Created')
     logger.info('Ready to execute task')
+    callback_arg = next(_callback_args)
+    if var.global_config.get('record_callbacks', False):
+        callback_recorders[callback_arg] = CallbackRecorder(get_journal_file(task_id, run_id))
+    task_start_time = time.perf_counter()
 
     result_succeed = False
     result_reason = []
     result_maatasks: list[MaataskRunResult] = []
+    snapshots = None
 
     try:
-        asstproxy = AsstProxy(task_id, logger, device, asst_callback)
+        asstproxy = AsstProxy(task_id, logger, device, asst_callback, callback_arg)
+        asstproxies[callback_arg] = asstproxy
         asstproxy.load_res(client_type)
         asstproxy.connect()
+        if device.failure_snapshots:
+            snapshots = FailureSnapshots(device.failure_snapshots, device, task_id, run_id, logger)
+            snapshots.start(asstproxy.asst)
 
         if device.current_status['server'] != client_type:
             if device.current_status['server']:
@@ -79,28 +138,29 @@ def start_task_process(process_static_params, process_shared_status):
             }
 
             if getupdate_support_info[client_type]:
-                local_version = device.adb.get_game_version(client_type)
+                with tracing.span('update.version_check'):
+                    local_version = device.get_game_version(client_type)
 
-                need_update = False
-                newest = ''
-                local = ''
+                    need_update = False
+                    newest = ''
+                    local = ''
 
-                try:
-                    if client_type == 'Official':
-                        newest = ArknightsAPI.get_newest_version()
-                        local = local_version.replace('.', '')
-                        need_update = newest != local
-                    elif client_type in ['YoStarJP', 'YoStarEN', 'YoStarKR', 'txwy']:
-                        newest = QooAppAPI.get_newest_version(client_type)
-                        local = local_version
-                        need_update = newest != local
-                    elif client_type == 'Bilibili':
-                        newest = BiligameAPI.get_newest_version()
-                        local = local_version
-                        need_update = newest != local
-                    logger.debug(f'newest version = {newest}, local version = {local}')
-                except Exception as e:
-                    logger.warning(f'An unexpected error was occured when getting update: {e}')
+                    try:
+                        if client_type == 'Official':
+                            newest = ArknightsAPI.get_newest_version()
+                            local = local_version.replace('.', '')
+                            need_update = newest != local
+                        elif client_type in ['YoStarJP', 'YoStarEN', 'YoStarKR', 'txwy']:
+                            newest = QooAppAPI.get_newest_version(client_type)
+                            local = local_version
+                            need_update = newest != local
+                        elif client_type == 'Bilibili':
+                            newest = BiligameAPI.get_newest_version()
+                            local = local_version
+                            need_update = newest != local
+                        logger.debug(f'newest version = {newest}, local version = {local}')
+                    except Exception as e:
+                        logger.warning(f'An unexpected error was occured when getting update: {e}')
 
                 if need_update:
                     if update_support_info[client_type]:
@@ -119,10 +179,12 @@ def start_task_process(process_static_params, process_shared_status):
                             download_to = var.cache_path / convert_str_to_legal_filename_windows(f'arknights_{client_type}_{newest}_{int(time.time())}.apk')
 
                             logger.debug(f'Start to download the newest version')
-                            download(newest_link, download_to)
+                            with tracing.span('update.download'):
+                                download(newest_link, download_to)
 
                             logger.debug(f'Start to install')
-                            device.adb.install(download_to)
+                            with tracing.span('update.install'):
+                                device.install(download_to)
 
                             download_to.unlink(True)
                             logger.info('Arknights client has been successfully updated')
@@ -131,7 +193,12 @@ def start_task_process(process_static_params, process_shared_status):
                     else:
                         raise Exception(f'The newest version is {newest} but the local version is {local}. The task cannot be run')
 
-        try_run(update, (), 2, 3000)
+        if var.global_config.get('check_game_update', True):
+            with tracing.span('update'):
+                try:
+                    call(UPDATE_POLICY, update, logger=logger)
+                except RetryError as e:
+                    raise e.__cause__
 
         remain_time = var.global_config.get('max_task_waiting_time', 3600)
         execute, execute_disabled_by = True, ''
@@ -139,30 +206,43 @@ def start_task_process(process_static_params, process_shared_status):
             maatask_name = maatask['task_name']
             if remain_time > 0:
                 if execute:
-                    run_result = asstproxy.run_maatask(maatask, remain_time)
+                    with tracing.span(f'maatask {maatask_name}', type=maatask_name):
+                        run_result = asstproxy.run_maatask(maatask, remain_time)
                     if maatask_name == 'StartUp' and not run_result.exec_result.succeed:
                         execute, execute_disabled_by = False, maatask_name
                     remain_time = run_result.time_remain
                     result_maatasks.append(run_result)
+                    if snapshots:
+                        snapshots.maatask_ended(maatask_name, run_result.exec_result.reason)
+                    record_maatask_metrics(run_result, device, client_type)
+                    process_shared_status['maatasks'] = [t.dict() for t in result_maatasks]
+                    if isolated:
+                        process_shared_status['metrics'] = metrics.registry.dump()
                 else:
                     result_maatasks.append(MaataskRunResult(maatask_name, False, [f'Skipped: disabled by {execute_disabled_by}'], 0, 0))
             else:
                 result_maatasks.append(MaataskRunResult(maatask_name, False, ['LackTime'], 0, 0))
 
-        # dev.exec_adb(f'shell screencap -p /sdcard/DCIM/AkhCLI_{id}_{int(time.time())}.png')
-
         result_succeed = all([t.exec_result.succeed for t in result_maatasks])
         result_maatasks = [t.dict() for t in result_maatasks]
 
+        del asstproxies[callback_arg]
         del asstproxy
         logger.debug('Ready to exit')
     except Exception as e:
         result_succeed = False
         error_str = f'An unexpected error was occured when running: {e}'
         result_reason = [error_str]
-        result_maatasks = []
+        # the maatasks which ended before it are kept, for resume and game_day
+        result_maatasks = [t.dict() if isinstance(t, MaataskRunResult) else t for t in result_maatasks]
         logger.error(error_str, exc_info=True)
     finally:
+        if snapshots:
+            snapshots.stop()
+        asstproxies.pop(callback_arg, None)
+        metrics.observe('arkhelper_task_duration_seconds', time.perf_counter() - task_start_time, server=client_type, device=device.alias)
+        if not result_succeed:
+            metrics.inc('arkhelper_task_failures_total', server=client_type, reason='Exception' if result_reason else 'MaataskFailed')
         process_shared_status['result'] = {
             'task': task_id,
             'exec_result': {
@@ -171,3 +251,14 @@ def start_task_process(process_static_params, process_shared_status):
                 'maatasks': result_maatasks
             }
         }
+        if recorder := callback_recorders.pop(callback_arg, None):
+            recorder.close()
+
+
+def record_maatask_metrics(run_result: MaataskRunResult, device: Device, client_type):
+    metrics.observe('arkhelper_maatask_duration_seconds', run_result.duration, type=run_result.type, device=device.alias, server=client_type)
+    if run_result.exec_result.tried_times > 1:
+        metrics.inc('arkhelper_maatask_retries_total', run_result.exec_result.tried_times - 1, type=run_result.type, server=client_type)
+    if not run_result.exec_result.succeed:
+        for reason in run_result.exec_result.reason:
+            metrics.inc('arkhelper_maatask_failures_total', type=run_result.type, reason=metrics.reason_label(reason))
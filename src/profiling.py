@@ -0,0 +1,96 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+
+import var
+from utils import convert_str_to_legal_filename_windows
+
+
+def get_profile_dir():
+    return var.log_path / 'profile' / var.run_id
+
+
+class Profiler:
+    '''
+    cProfile only follows the thread it is enabled in, so every thread started through `threading` gets its own profile.
+    All of them are merged into one stats file when saving.
+    '''
+
+    def __init__(self, name) -> None:
+        self.name = name
+        self._profiles: list[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def _new_profile(self) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def _thread_bootstrap(self, frame, event, arg):
+        # enabling replaces this hook for the new thread
+        self._new_profile().enable()
+
+    def start(self):
+        threading.setprofile(self._thread_bootstrap)
+        self._new_profile().enable()
+
+    def stop(self):
+        threading.setprofile(None)
+        with self._lock:
+            profiles = list(self._profiles)
+        for profile in profiles:
+            profile.disable()
+
+        profile_dir = get_profile_dir()
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        file = profile_dir / f'{convert_str_to_legal_filename_windows(self.name)}-{os.getpid()}.prof'
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            try:
+                stats.add(profile)
+            except TypeError:
+                # the profile of a thread which has never returned to python has no stats
+                pass
+        stats.dump_stats(str(file))
+        logging.debug(f'Profile of {self.name} saved to {file}')
+
+
+def run_profiled(name, func, *args, **kwargs):
+    profiler = Profiler(name)
+    profiler.start()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.stop()
+
+
+def aggregate(top=60):
+    '''
+    Merge the stats of the runner and all task processes of this run into aggregated.prof and a text report
+    '''
+    profile_dir = get_profile_dir()
+    files = sorted(str(f) for f in profile_dir.glob('*.prof') if f.name != 'aggregated.prof')
+    if not files:
+        return None
+
+    stats = pstats.Stats(*files)
+    stats.dump_stats(str(profile_dir / 'aggregated.prof'))
+
+    stream = io.StringIO()
+    stream.write(f'Merged from {len(files)} processes:\n')
+    [stream.write(f'  {os.path.basename(f)}\n') for f in files]
+    stats.stream = stream
+    for sort_key in ('tottime', 'cumulative'):
+        stream.write(f'\n===== Top {top} functions by {sort_key} =====\n')
+        stats.sort_stats(sort_key).print_stats(top)
+
+    report = profile_dir / 'aggregated.txt'
+    with open(str(report), 'w', encoding='utf8') as file:
+        file.write(stream.getvalue())
+    logging.info(f'Aggregated profile of {len(files)} processes is written to {report}')
+    return report
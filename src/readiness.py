@@ -0,0 +1,91 @@
+'''
+Readiness of devices: cheap adb probes (Device.probe) repeated with exponential backoff and jitter,
+so that MaaCore connects only once a device answers.
+'''
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import var
+from retry import backoff_delays
+
+if TYPE_CHECKING:
+    from model import Device
+
+DEFAULT_READINESS = {
+    'timeout': 180,  # seconds to wait for a device
+    'backoff_base': 1,
+    'backoff_cap': 10
+}
+
+
+def get_readiness_config() -> dict:
+    return {**DEFAULT_READINESS, **var.global_config.get('readiness', {})}
+
+
+def wait_until_ready(device: 'Device', config: dict | None = None, stop_event: threading.Event | None = None, logger: logging.Logger | None = None) -> bool:
+    config = config or get_readiness_config()
+    logger = logger or device.logger
+    deadline = time.monotonic() + config['timeout']
+    for tried_time, delay in enumerate(backoff_delays(config['backoff_base'], config['backoff_cap'])):
+        try:
+            if device.probe():
+                logger.debug(f'Device is ready after {tried_time + 1} probes')
+                return True
+        except Exception as e:
+            logger.debug(f'Probe failed: {e}')
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f'Device is not ready after {config["timeout"]} sec')
+            return False
+        if stop_event:
+            if stop_event.wait(min(delay, remaining)):
+                return False
+        else:
+            time.sleep(min(delay, remaining))
+
+
+class ReadinessProber:
+    '''
+    Probe many devices concurrently on behalf of the runner, which only distributes tasks to devices which answered
+    '''
+
+    def __init__(self, config: dict | None = None, max_workers=8) -> None:
+        self.config = config or get_readiness_config()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='readiness')
+        self._probes: dict[str, concurrent.futures.Future] = {}
+        self._stop_event = threading.Event()
+
+    def watch(self, device: 'Device') -> concurrent.futures.Future:
+        if device.alias not in self._probes:
+            self._probes[device.alias] = self._executor.submit(wait_until_ready, device, self.config, self._stop_event)
+        return self._probes[device.alias]
+
+    def is_ready(self, device: 'Device', wait=1.0) -> bool:
+        '''
+        Start probing the device if it is not watched yet, waiting for the first probe at most `wait` sec. Also True once the probe gave up,
+        the task reports the failure then, instead of the device holding its tasks forever
+        '''
+        started = device.alias not in self._probes
+        probe = self.watch(device)
+        if started:
+            # a device which is up answers the first probe right away
+            concurrent.futures.wait([probe], timeout=wait)
+        if not probe.done():
+            return False
+        if not probe.result():
+            device.logger.warning('Device did not become ready, distributing the task anyway')
+            self.forget(device)
+        return True
+
+    def forget(self, device: 'Device'):
+        '''
+        The device was killed, it has to be probed again before the next task
+        '''
+        self._probes.pop(device.alias, None)
+
+    def stop(self):
+        self._stop_event.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,198 @@
+'''
+Retention of what runs leave on disk: logs, MaaCore userdirs, snapshots, callback journals, profiles, memory timelines,
+conclusions and downloaded apks. Every area has an age quota and a size quota, the oldest entries over either are removed,
+logs older than gzip_after_days are gzipped first. Entries touched by the current run are never touched.
+
+It runs on a daemon thread started with the CLI (start), and again every interval_hours for as long as the CLI runs,
+so dispatching never waits for it.
+
+MaaCore userdirs can be moved to a tmpfs with scratch_path (see utils.init): they are scratch data of a task
+(debug images, asst.log), which only need to outlive it until the next cleanup.
+'''
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import var
+
+DEFAULT_AREAS = {
+    'logs': {'max_age_days': 30, 'max_size_mb': 1024, 'gzip_after_days': 1},
+    'userdirs': {'max_age_days': 7, 'max_size_mb': 2048},
+    'snapshots': {'max_age_days': 14, 'max_size_mb': 1024},
+    'callbacks': {'max_age_days': 14, 'max_size_mb': 1024},
+    'profiles': {'max_age_days': 14, 'max_size_mb': 512},
+    'memory': {'max_age_days': 30, 'max_size_mb': 256},
+    'conclusion': {'max_age_days': 90, 'max_size_mb': 512},
+    'cache': {'max_age_days': 30, 'max_size_mb': 4096},
+}
+DEFAULT_RETENTION = {'enable': True, 'interval_hours': 24, 'scratch_path': None}
+
+# where the entries of an area are: (root, glob patterns relative to it). An entry is a file or a whole directory
+AREAS: dict[str, Callable[[], tuple[Path, list[str]]]] = {
+    'logs': lambda: (var.log_path, ['*.log', '*.log.gz']),
+    # MaaCore keeps its config and cache next to debug, only debug grows
+    'userdirs': lambda: (var.maa_usrdir_path, ['*/debug/*']),
+    'snapshots': lambda: (var.log_path / 'snapshots', ['*']),
+    'callbacks': lambda: (var.log_path / 'callbacks', ['*']),
+    'profiles': lambda: (var.log_path / 'profile', ['*']),
+    'memory': lambda: (var.log_path / 'memory', ['*']),
+    'conclusion': lambda: (var.cli_env / 'conclusion', ['*']),
+    'cache': lambda: (var.cache_path, ['*.apk']),
+}
+
+
+def get_retention_config() -> dict:
+    config = {**DEFAULT_RETENTION, **var.global_config.get('retention', {})}
+    areas = config.get('areas', {})
+    config['areas'] = {name: {**default, **areas.get(name, {})} for name, default in DEFAULT_AREAS.items()}
+    return config
+
+
+@dataclass
+class Entry:
+    path: Path
+    size: int
+    mtime: float
+
+
+def measure(path: Path) -> Entry:
+    '''
+    Size of a file or a directory tree, and the newest mtime of its files (of the directory itself when it has none)
+    '''
+    stat = path.stat()
+    size, mtime = stat.st_size, stat.st_mtime
+    if path.is_dir():
+        size, mtime = 0, (mtime if not any(path.iterdir()) else 0)
+        for home, dirs, files in os.walk(path):
+            for filename in files:
+                try:
+                    stat = os.stat(os.path.join(home, filename))
+                except FileNotFoundError:
+                    continue
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime)
+    return Entry(path, size, mtime)
+
+
+def remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def gzip_file(path: Path) -> Path:
+    '''
+    Replace path with path.gz, keeping its mtime. A copy cut by an exit is left as .gz.tmp and removed by the next cleanup
+    '''
+    target = path.with_name(path.name + '.gz')
+    temporary = path.with_name(path.name + '.gz.tmp')
+    with open(path, 'rb') as source, gzip.open(temporary, 'wb') as destination:
+        shutil.copyfileobj(source, destination)
+    stat = path.stat()
+    os.utime(temporary, (stat.st_atime, stat.st_mtime))
+    temporary.replace(target)
+    path.unlink()
+    return target
+
+
+@dataclass
+class Outcome:
+    removed: int = 0
+    gzipped: int = 0
+    freed: int = 0
+
+
+def clean_area(root: Path, patterns: list[str], max_age_days=None, max_size_mb=None, gzip_after_days=None,
+               protect_after: float | None = None, now: float | None = None) -> Outcome:
+    '''
+    Entries modified after protect_after belong to a running task or run, they are not gzipped, removed, nor counted
+    '''
+    now = now or time.time()
+    outcome = Outcome()
+    if not root.exists():
+        return outcome
+    for leftover in root.glob('*.gz.tmp'):
+        remove(leftover)
+
+    entries = []
+    for pattern in patterns:
+        for path in root.glob(pattern):
+            try:
+                entry = measure(path)
+            except FileNotFoundError:
+                continue
+            if protect_after is None or entry.mtime < protect_after:
+                entries.append(entry)
+    entries.sort(key=lambda entry: entry.mtime)
+
+    kept = []
+    for entry in entries:
+        if max_age_days is not None and now - entry.mtime > max_age_days * 86400:
+            remove(entry.path)
+            outcome.removed += 1
+            outcome.freed += entry.size
+            continue
+        if gzip_after_days is not None and entry.path.is_file() and entry.path.suffix != '.gz' and now - entry.mtime > gzip_after_days * 86400:
+            try:
+                entry.path = gzip_file(entry.path)
+            except OSError as e:
+                logging.warning(f'Failed to gzip {entry.path}: {e}')
+            else:
+                size = entry.path.stat().st_size
+                outcome.gzipped += 1
+                outcome.freed += entry.size - size
+                entry.size = size
+        kept.append(entry)
+
+    if max_size_mb is not None:
+        total = sum(entry.size for entry in kept)
+        # oldest first
+        for entry in kept:
+            if total <= max_size_mb * 1024 ** 2:
+                break
+            remove(entry.path)
+            total -= entry.size
+            outcome.removed += 1
+            outcome.freed += entry.size
+    return outcome
+
+
+def clean(config: dict | None = None) -> dict[str, Outcome]:
+    config = config or get_retention_config()
+    # the current run, and anything written in the last hour, may still be in use
+    protect_after = min(var.start_time.timestamp(), time.time() - 3600)
+    outcomes = {}
+    for name, quotas in config['areas'].items():
+        root, patterns = AREAS[name]()
+        try:
+            outcomes[name] = outcome = clean_area(root, patterns, **quotas, protect_after=protect_after)
+        except Exception as e:
+            logging.warning(f'Failed to clean {name} in {root}: {e}')
+            continue
+        if outcome.removed or outcome.gzipped:
+            logging.info(f'Retention of {name}: {outcome.removed} removed, {outcome.gzipped} gzipped, {outcome.freed / 1024 ** 2:.1f} MB freed')
+    return outcomes
+
+
+def _loop(config: dict):
+    while True:
+        clean(config)
+        if not config['interval_hours']:
+            return
+        time.sleep(config['interval_hours'] * 3600)
+
+
+def start() -> threading.Thread | None:
+    config = get_retention_config()
+    if not config['enable']:
+        return None
+    thread = threading.Thread(target=_loop, args=(config,), name='retention', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,150 @@
+'''
+Retries and timeouts of flaky calls (MaaCore loading and connecting, the game update, adb commands), declared as policies:
+
+    ADB_POLICY = RetryPolicy(attempts=2, retry_on=(subprocess.TimeoutExpired,), breaker='adb')
+    out, err = call(ADB_POLICY, run_subprocess, cmd, timeout, breaker_key=device)
+
+A call is tried up to `attempts` times, sleeping an exponential backoff with jitter between tries. Only exceptions of
+`retry_on`, and results `accept` rejects, are retried; anything else is raised at once. A failed last try raises RetryError,
+so does a failed try once `deadline_sec` passed since the first one, or would pass before the next one.
+With `breaker`, calls sharing a breaker key fail fast with CircuitOpenError once `breaker_threshold` of them
+failed in a row, until `breaker_reset_sec` passed, when one call is let through to probe.
+
+A try is cancelled for real only where there is a boundary to cancel it at: run_subprocess kills the process tree of the
+command when it times out. Native calls (Asst.load, Asst.connect) run inline: deadline_sec bounds how long they are
+retried, but a single hung call is only ended by the watchdog of the runner, which kills the task (see maa_runner.execute).
+'''
+import logging
+import random
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+
+import psutil
+
+
+class RetryError(Exception):
+    '''
+    Every try failed, __cause__ is the error of the last one
+    '''
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def backoff_delays(base, cap, jitter=0.5) -> Iterator[float]:
+    '''
+    base, 2*base, 4*base ... up to cap, each multiplied by a random factor in [1-jitter, 1+jitter]
+    '''
+    attempt = 0
+    while True:
+        yield min(cap, base * 2 ** attempt) * random.uniform(1 - jitter, 1 + jitter)
+        attempt += 1
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 3
+    backoff_base: float = 1
+    backoff_cap: float = 30
+    jitter: float = 0.5
+    retry_on: tuple[type[BaseException], ...] = (Exception,)
+    accept: Callable[[Any], bool] | None = None  # results it returns False for are retried, like a failure
+    breaker: str | None = None
+    breaker_threshold: int = 5
+    breaker_reset_sec: float = 60
+    deadline_sec: float | None = None  # no try is started after this long since the first one
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, reset_sec: float) -> None:
+        self.threshold = threshold
+        self.reset_sec = reset_sec
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_sec:
+                # half open: let this one probe, the next ones wait for its result
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def succeeded(self):
+        with self._lock:
+            self.failures, self.opened_at = 0, None
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+_breakers: dict[tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(policy: RetryPolicy, key='') -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get((policy.breaker, key))
+        if breaker is None:
+            breaker = _breakers[(policy.breaker, key)] = CircuitBreaker(policy.breaker_threshold, policy.breaker_reset_sec)
+        return breaker
+
+
+def call(policy: RetryPolicy, func: Callable, *args, breaker_key='', logger: logging.Logger | None = None, **kwargs):
+    logger = logger or logging.getLogger(f'retry({func.__name__})')
+    breaker = get_breaker(policy, str(breaker_key)) if policy.breaker else None
+    delays = backoff_delays(policy.backoff_base, policy.backoff_cap, policy.jitter)
+    error = None
+    started = time.monotonic()
+    for tried_time in range(policy.attempts):
+        if breaker and not breaker.allow():
+            raise CircuitOpenError(f'{policy.breaker} {breaker_key} failed {breaker.failures} times in a row, calls are refused for {policy.breaker_reset_sec} sec')
+        logger.debug(f'{tried_time + 1}st/{policy.attempts}max trying')
+        try:
+            result = func(*args, **kwargs)
+            if policy.accept and not policy.accept(result):
+                raise RetryError(f'{func.__name__} returned {result!r}')
+        except (*policy.retry_on, RetryError) as e:
+            error = e
+            if breaker:
+                breaker.failed()
+            logger.warning(f'{tried_time + 1}st/{policy.attempts}max failed: {e}')
+        else:
+            if breaker:
+                breaker.succeeded()
+            return result
+        if tried_time + 1 < policy.attempts:
+            delay = next(delays)
+            if policy.deadline_sec is not None and time.monotonic() - started + delay > policy.deadline_sec:
+                raise RetryError(f'{func.__name__} failed {tried_time + 1} times in {time.monotonic() - started:.0f}s, '
+                                 f'no try left within {policy.deadline_sec}s') from error
+            time.sleep(delay)
+    raise RetryError(f'{func.__name__} failed {policy.attempts} times') from error
+
+
+def run_subprocess(cmd: str, timeout: float | None) -> tuple[bytes, bytes]:
+    '''
+    (stdout, stderr) of a shell command. On timeout the shell and everything it started are killed before TimeoutExpired is raised
+    '''
+    proc = subprocess.Popen(cmd, stdin=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    try:
+        return proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        try:
+            for child in psutil.Process(proc.pid).children(recursive=True):
+                child.kill()
+        except psutil.NoSuchProcess:
+            pass
+        proc.kill()
+        proc.communicate()
+        raise
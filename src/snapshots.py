@@ -0,0 +1,92 @@
+'''
+Failure snapshots: the screen of a device is kept in a bounded in-memory ring covering the last seconds of the task,
+and is written to Data/Log/snapshots/<run>/<task> only when a maatask ends in TaskChainError or a timeout.
+
+Frames are PNG as produced by MaaCore (AsstGetImage) or `adb exec-out screencap -p`, so they are stored as they come.
+'''
+import collections
+import logging
+import math
+import time
+from pathlib import Path
+
+import var
+from capture import CaptureLoop, ScreencapLoop
+from MAA.asst.asst import Asst
+from model import Device
+from utils import convert_str_to_legal_filename_windows
+
+FLUSH_REASONS = ['TaskChainError', 'Timeout']
+
+
+def get_snapshot_dir(task_id, run_id=None) -> Path:
+    return var.log_path / 'snapshots' / (run_id or var.run_id) / convert_str_to_legal_filename_windows(task_id)
+
+
+class SnapshotRing:
+    def __init__(self, seconds=30, interval=2.0) -> None:
+        self.seconds = seconds
+        self._frames: collections.deque[tuple[float, bytes]] = collections.deque(maxlen=max(1, math.ceil(seconds / interval)))
+
+    def add(self, frame: memoryview | bytes, timestamp: float):
+        # the frame may live in a pooled buffer, which is overwritten by the next capture
+        self._frames.append((timestamp, bytes(frame)))
+
+    def frames(self) -> list[tuple[float, bytes]]:
+        if not self._frames:
+            return []
+        newest = self._frames[-1][0]
+        return [(t, f) for t, f in list(self._frames) if newest - t <= self.seconds]
+
+    def flush(self, path: Path) -> int:
+        '''
+        Write the frames as <offset to the last frame>.png into path and empty the ring
+        '''
+        frames = self.frames()
+        self._frames.clear()
+        if not frames:
+            return 0
+        path.mkdir(parents=True, exist_ok=True)
+        newest = frames[-1][0]
+        for timestamp, frame in frames:
+            (path / f'{timestamp - newest:+07.1f}s.png').write_bytes(frame)
+        return len(frames)
+
+
+class FailureSnapshots:
+    '''
+    Capture thread and ring of one task, configured by `failure_snapshots` of the device or the global config:
+    {seconds: 30, interval: 2, source: asst|adb}
+    '''
+
+    def __init__(self, config: dict, device: Device, task_id, run_id, logger: logging.Logger) -> None:
+        self.task_id = task_id
+        self.run_id = run_id
+        self._logger = logger
+        interval = config.get('interval', 2)
+        self.ring = SnapshotRing(config.get('seconds', 30), interval)
+        self.source = config.get('source', 'asst')
+        self._device = device
+        self._interval = interval
+        self._loop: CaptureLoop | None = None
+
+    def start(self, asst: Asst):
+        if self.source == 'adb':
+            self._loop = ScreencapLoop(self._device.adb, self.ring.add, self._interval, self._logger)
+        else:
+            self._loop = CaptureLoop(asst, self.ring.add, self._interval, logger=self._logger)
+        self._loop.start()
+
+    def maatask_ended(self, maatask_name, reason: list[str]):
+        '''
+        Flush the ring if the maatask ended in a way worth looking at afterwards
+        '''
+        if not any(r in FLUSH_REASONS for r in reason):
+            return
+        path = get_snapshot_dir(self.task_id, self.run_id) / f'{convert_str_to_legal_filename_windows(maatask_name)}-{int(time.time())}'
+        count = self.ring.flush(path)
+        self._logger.info(f'{count} snapshots of the failed maatask {maatask_name} were written to {path}')
+
+    def stop(self):
+        if self._loop:
+            self._loop.stop()
@@ -1,3 +1,5 @@
+import collections
+
 from utils import *
 
 
@@ -5,10 +7,11 @@ def choice_stage(server, preference_dict: dict):
     stages_in_limit_list = [cp for cp in preference_dict if cp.rsplit('-', 1)[0] in arknights_stage_opening_time]
     stages_outof_limit_list = [cp for cp in preference_dict if not cp.rsplit('-', 1)[0] in arknights_stage_opening_time]
 
+    weekday = in_game_time(datetime.now(), server).weekday()
     for stage in stages_in_limit_list:
         opening_time = arknights_stage_opening_time[stage.rsplit('-', 1)[0]]
 
-        if in_game_time(datetime.now(), server).weekday() not in opening_time:
+        if weekday not in opening_time:
             preference_dict.pop(stage)
             continue
 
@@ -19,3 +22,25 @@ def choice_stage(server, preference_dict: dict):
         preference_dict[stage] /= 7  # 平衡概率
 
     return random_choice_with_weights(preference_dict)
+
+
+def pick_task(device_alias, current_server, tasks: list[dict], servers_running: dict[str, int] | None = None) -> dict | None:
+    '''
+    Next task of a device. Tasks pinned to the device come first, then the unpinned ones.
+    Switching the server costs a force-stop, a full StartUp and a resource reload, which outweighs anything else here,
+    so the device keeps the server it has running as long as it has tasks of it. When it has to switch, it takes the server
+    with the most queued tasks per device already running it (servers_running), so that servers are batched instead of interleaved
+    '''
+    candidates = [task for task in tasks if task.get('device') == device_alias] or [task for task in tasks if task.get('device') is None]
+    if not candidates:
+        return None
+    servers_running = servers_running or {}
+    queued = collections.Counter(task['server'] for task in candidates)
+
+    def cost(item):
+        index, task = item
+        server = task['server']
+        switch = current_server is not None and server != current_server
+        return switch, -queued[server] / (1 + servers_running.get(server, 0)), index
+
+    return min(enumerate(candidates), key=cost)[1]
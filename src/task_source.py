@@ -0,0 +1,142 @@
+'''
+Where the runner gets its tasks from: the local task list, or a coordinator leasing tasks to many hosts (see distributed.py)
+'''
+import logging
+import threading
+from urllib.parse import quote
+
+import http_api
+import game_day
+from journal import RunJournal
+
+
+class LocalTaskSource:
+    '''
+    The expanded tasks of this host (var.tasks), taking a task removes it from the list. Results go to the journal of the run
+    and to the game day dedupe
+    '''
+
+    def __init__(self, tasks: list[dict], journal: RunJournal | None = None) -> None:
+        self.tasks = tasks
+        self.journal = journal
+        self._taken: dict[str, dict] = {}
+
+    def refresh(self):
+        pass
+
+    def queued(self) -> list[dict]:
+        return self.tasks
+
+    def take(self, task: dict) -> bool:
+        self.tasks.remove(task)
+        self._taken[task['hash']] = task
+        return True
+
+    def maatask_ended(self, task_hash, maatask: dict):
+        if self.journal:
+            self.journal.maatask_ended(task_hash, maatask)
+
+    def done(self, task_hash, result: dict | None):
+        if self.journal:
+            self.journal.result(task_hash, result)
+        game_day.get_dedupe().record(self._taken.pop(task_hash), result)
+
+    def exhausted(self) -> bool:
+        '''
+        No task a device is waiting for can show up later. Nothing is ever requeued locally
+        '''
+        return True
+
+    def close(self):
+        pass
+
+
+class RemoteTaskSource:
+    '''
+    Tasks leased from a coordinator. The leases of the tasks running here are kept alive by a heartbeat,
+    if this host dies they expire and the coordinator requeues them for the other hosts
+    '''
+
+    def __init__(self, coordinator_url: str, worker_id: str, device_aliases: list[str], heartbeat_sec=10) -> None:
+        self.url = coordinator_url.rstrip('/')
+        self.worker_id = worker_id
+        self.device_aliases = device_aliases
+        self.heartbeat_sec = heartbeat_sec
+        self.leases: set[str] = set()
+        self._queued: list[dict] = []
+        self._leased_elsewhere = 0
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(f'worker({worker_id})')
+        self._stop_event = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='lease-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def _post(self, path, body: dict) -> dict:
+        return http_api.request(f'{self.url}{path}', {'worker': self.worker_id, **body})
+
+    def refresh(self):
+        try:
+            state = http_api.request(f'{self.url}/tasks?worker={quote(self.worker_id)}')
+        except OSError as e:
+            self._logger.warning(f'Failed to get tasks from the coordinator: {e}')
+            return
+        with self._lock:
+            self._queued = state['queued']
+            self._leased_elsewhere = state['leased'] - len(self.leases)
+
+    def queued(self) -> list[dict]:
+        return self._queued
+
+    def take(self, task: dict) -> bool:
+        try:
+            leased = self._post('/lease', {'hash': task['hash']})['ok']
+        except OSError as e:
+            self._logger.warning(f'Failed to lease task {task["hash"]}: {e}')
+            leased = False
+        with self._lock:
+            if task in self._queued:
+                self._queued.remove(task)
+            if leased:
+                self.leases.add(task['hash'])
+        return leased
+
+    def maatask_ended(self, task_hash, maatask: dict):
+        pass
+
+    def done(self, task_hash, result: dict | None):
+        with self._lock:
+            self.leases.discard(task_hash)
+        for tried_time in range(3):
+            try:
+                self._post('/result', {'hash': task_hash, 'result': result})
+                return
+            except OSError as e:
+                self._logger.warning(f'Failed to report the result of task {task_hash} {tried_time + 1}st/3 trying: {e}')
+                self._stop_event.wait(self.heartbeat_sec)
+
+    def exhausted(self) -> bool:
+        '''
+        Nothing is queued for the devices of this host and no lease of another host is running, which could expire and be requeued
+        '''
+        with self._lock:
+            takeable = [task for task in self._queued if task.get('device') in [None, *self.device_aliases]]
+            return not takeable and self._leased_elsewhere <= 0
+
+    def _heartbeat_loop(self):
+        while not self._stop_event.wait(self.heartbeat_sec):
+            with self._lock:
+                leases = list(self.leases)
+            try:
+                lost = self._post('/heartbeat', {'hashes': leases})['lost']
+            except OSError as e:
+                self._logger.warning(f'Heartbeat failed: {e}')
+                continue
+            for task_hash in lost:
+                self._logger.warning(f'Lease of task {task_hash} expired, the coordinator may have requeued it')
+
+    def close(self):
+        self._stop_event.set()
+        try:
+            self._post('/bye', {})
+        except OSError:
+            pass
@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+events: list[dict] = []
+_local = threading.local()
+# thread ident: name of its innermost open span
+_open_stages: dict[int, str] = {}
+
+
+def reset():
+    '''
+    Drop the events inherited from the parent process. Call it at the start of a task process
+    '''
+    global events
+    events = []
+    _open_stages.clear()
+    _local.__dict__.clear()
+
+
+def now_us() -> int:
+    # wall clock, so that timestamps of different processes can be put on the same timeline
+    return int(time.time() * 1_000_000)
+
+
+def _stack() -> list[str]:
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_stage() -> str | None:
+    '''
+    Name of the innermost open span of the current thread, or of the main thread if the current one has none
+    '''
+    stack = _stack()
+    if stack:
+        return stack[-1]
+    return _open_stages.get(threading.main_thread().ident)
+
+
+def open_stages() -> list[str]:
+    '''
+    Names of the innermost open spans of every thread, e.g. of the hosted tasks of a multi-instance host
+    '''
+    return sorted(set(_open_stages.values()))
+
+
+def add_complete_event(name, start_us, dur_us, cat='task', pid=None, tid=None, **args):
+    events.append({
+        'name': name,
+        'cat': cat,
+        'ph': 'X',
+        'ts': start_us,
+        'dur': max(dur_us, 0),
+        'pid': pid if pid is not None else os.getpid(),
+        'tid': tid if tid is not None else threading.get_native_id(),
+        'args': args
+    })
+
+
+def add_metadata(pid, name, tid=None, **args):
+    event = {
+        'name': 'process_name' if tid is None else 'thread_name',
+        'ph': 'M',
+        'pid': pid,
+        'args': {'name': name, **args}
+    }
+    if tid is not None:
+        event['tid'] = tid
+    events.append(event)
+
+
+@contextmanager
+def span(name, cat='task', **args):
+    stack = _stack()
+    ident = threading.get_ident()
+    stack.append(name)
+    _open_stages[ident] = name
+    start = now_us()
+    try:
+        yield
+    finally:
+        add_complete_event(name, start, now_us() - start, cat, **args)
+        stack.pop()
+        if stack:
+            _open_stages[ident] = stack[-1]
+        else:
+            _open_stages.pop(ident, None)
+
+
+def dump() -> list[dict]:
+    return list(events)
+
+
+def take() -> list[dict]:
+    '''
+    The events recorded so far, dropped from this process, for a process which outlives runs
+    '''
+    global events
+    taken, events = events, []
+    return taken
+
+
+def summarize(trace_events: list[dict]) -> dict:
+    '''
+    Device utilization and the critical path of a run, computed from the device tracks recorded by the runner
+    '''
+    runs = [e for e in trace_events if e.get('ph') == 'X' and e['name'] == 'run']
+    if not runs:
+        return {}
+    run_event = runs[0]
+    run_start, makespan = run_event['ts'], run_event['dur']
+
+    # task: (pid, tid) of its track, tid is None for a task process, the thread of a hosted task otherwise
+    task_tracks = {e['args']['task']: (e['pid'], e.get('tid')) for e in trace_events if e.get('ph') == 'M' and 'task' in e['args']}
+    device_events: dict[str, list[dict]] = {}
+    for e in trace_events:
+        if e.get('ph') == 'X' and e.get('cat') == 'device':
+            device_events.setdefault(e['args']['device'], []).append(e)
+
+    utilization = {}
+    critical_device, critical_end = None, -1
+    for device, _events in device_events.items():
+        tasks = [e for e in _events if e['name'] == 'task']
+        busy = sum(e['dur'] for e in tasks)
+        utilization[device] = {
+            'busy_sec': busy / 1e6,
+            'idle_sec': sum(e['dur'] for e in _events if e['name'] == 'idle') / 1e6,
+            'tasks': len(tasks),
+            'utilization': busy / makespan if makespan else 0
+        }
+        end = max((e['ts'] + e['dur'] for e in tasks), default=-1)
+        if end > critical_end:
+            critical_device, critical_end = device, end
+
+    critical_path = []
+    for e in sorted(device_events.get(critical_device, []), key=lambda e: e['ts']):
+        segment = {
+            'name': e['name'],
+            'task': e['args'].get('task'),
+            'start_sec': (e['ts'] - run_start) / 1e6,
+            'dur_sec': e['dur'] / 1e6
+        }
+        if e['name'] == 'task' and (track := task_tracks.get(segment['task'])) is not None:
+            pid, tid = track
+            stages = [s for s in trace_events if s.get('ph') == 'X' and s['pid'] == pid and (tid is None or s['tid'] == tid) and s['cat'] not in ('device', 'runner')]
+            segment['stages'] = [{'name': s['name'], 'dur_sec': s['dur'] / 1e6} for s in sorted(stages, key=lambda s: s['ts'])]
+        critical_path.append(segment)
+
+    return {
+        'makespan_sec': makespan / 1e6,
+        'devices': utilization,
+        'critical_device': critical_device,
+        'critical_path': critical_path
+    }
+
+
+def write_trace(path, trace_events: list[dict]):
+    with open(str(path), 'w', encoding='utf8') as file:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, file, ensure_ascii=False)
@@ -1,11 +1,8 @@
 import os
-import ctypes
 import hashlib
 import json
 import logging
 import random
-import threading
-import time
 import tqdm
 import psutil
 import argparse
@@ -14,20 +11,18 @@ import requests
 import yaml
 import pytz
 import colorlog
-from io import StringIO
 from urllib.parse import quote
-from typing import Callable
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
-from line_profiler import LineProfiler  # do not remove this. It's needed by main.py, passing by import *
 
 import var
 
 
 def init():
-    mode, verbose = parse_arg()
+    mode, verbose, profile, mode_args = parse_arg()
 
     var.start_time = datetime.now()
+    var.run_id = var.start_time.strftime('%Y-%m-%d-%H-%M-%S')
     var.cli_env = Path()
     var.data_path = var.cli_env / 'Data'
     var.config_path = var.data_path / 'Config'
@@ -40,8 +35,12 @@ def init():
     var.config_templates = get_config_templates()
     var.tasks = []
     var.maa_env = Path(var.global_config['maa_path'])
-    var.maa_usrdir_path = var.maa_env / f'userdir'
+    # MaaCore userdirs, on a tmpfs with scratch_path of retention
+    scratch_path = var.global_config.get('retention', {}).get('scratch_path')
+    var.maa_usrdir_path = Path(scratch_path) if scratch_path else var.maa_env / 'userdir'
     var.verbose = verbose
+    var.profile = profile
+    var.mode_args = mode_args
 
     mk_CLI_dir()
     logging.basicConfig(level=logging.DEBUG, handlers=get_logging_handlers())
@@ -55,18 +54,7 @@ def mk_CLI_dir():
     var.log_path.mkdir(exist_ok=True)
     var.static_path.mkdir(exist_ok=True)
     var.cache_path.mkdir(exist_ok=True)
-    var.maa_usrdir_path.mkdir(exist_ok=True)
-
-
-def run_with_LineProfiler(func, *args, **kwargs):
-    profile = LineProfiler(func)
-    result = profile.runcall(func, *args, **kwargs)
-
-    stream = StringIO()
-    profile.print_stats(stream=stream)
-
-    logging.debug(stream.getvalue())
-    return result
+    var.maa_usrdir_path.mkdir(parents=True, exist_ok=True)
 
 
 def convert_str_to_legal_filename_windows(filename):
@@ -93,25 +81,16 @@ def get_config_templates():
     return result
 
 
-def is_process_running(process_name):
-    for process in psutil.process_iter(['name']):
-        try:
-            process_info = process.info
-            if process_info['name'] == process_name:
-                return True
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
-    return False
+def is_process_running(process_name, table: 'ProcessTable | None' = None):
+    return bool((table or ProcessTable.snapshot()).pids_by_name(process_name))
 
 
-def get_pid_by_port(port) -> int | None:
+def get_pid_by_port(port, table: 'ProcessTable | None' = None) -> int | None:
     '''
     Can safely pass in None (return None)
     '''
     if port:
-        for conn in psutil.net_connections(kind='inet'):
-            if conn.laddr.port == int(port):
-                return conn.pid
+        return (table or ProcessTable.snapshot()).pid_by_port(port)
     return None
 
 
@@ -128,11 +107,23 @@ def parse_arg():
 
     parser.add_argument('-h', '--help', action='store_true')
     parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('--profile', action='store_true', help='Profile the runner and every task process, stats are saved to Data/Log/profile/<run>')
 
     subparsers = parser.add_subparsers(title='Subcommands', dest='subcommand')
 
     subparser_run = subparsers.add_parser('run', help='Start running MAA according to config. ')
+    subparser_run.add_argument('--resume', nargs='?', const='latest', metavar='JOURNAL',
+                               help='Run only what the latest run (or the run of the journal file given) did not finish, with its task plans')
     subparser_test = subparsers.add_parser('test', help='Mode for develop. ')
+    subparser_coordinator = subparsers.add_parser('coordinator', help='Lease the tasks to workers on other hosts and report their results. ')
+    subparser_coordinator.add_argument('--host', help='Default is distributed.host of global config, or 127.0.0.1')
+    subparser_coordinator.add_argument('--port', type=int, help='Default is distributed.port of global config, or 8765')
+    subparser_daemon = subparsers.add_parser('daemon', help='Keep running, start runs on schedules and on requests to a local API. ')
+    subparser_daemon.add_argument('--host', help='Default is daemon.host of global config, or 127.0.0.1')
+    subparser_daemon.add_argument('--port', type=int, help='Default is daemon.port of global config, or 8766')
+    subparser_worker = subparsers.add_parser('worker', help='Run tasks leased from a coordinator on the devices of this host. ')
+    subparser_worker.add_argument('--coordinator', help='Url of the coordinator, default is distributed.coordinator of global config')
+    subparser_worker.add_argument('--id', help='Name of this worker, default is <hostname>-<start time>')
     # subparser_run.add_argument('arg1')
 
     args = parser.parse_args()
@@ -142,8 +133,11 @@ def parse_arg():
 
     mode = args.subcommand
     verbose = args.verbose
+    profile = args.profile
+    # options of the subcommand
+    mode_args = {k: v for k, v in vars(args).items() if k not in ['help', 'verbose', 'profile', 'subcommand'] and v is not None}
 
-    return mode, verbose
+    return mode, verbose, profile, mode_args
 
 
 def get_cur_time_f_hhmm():
@@ -255,53 +249,113 @@ def get_process_start_location(pid):
         return None
 
 
-def get_pids_by_process_name(process_name):
-    matching_pids = []
-    for process in psutil.process_iter(['pid', 'name']):
-        try:
-            process_info = process.info
-            if process_info['name'] == process_name:
-                matching_pids.append(process_info['pid'])
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-            pass
-    return matching_pids
+def get_pids_by_process_name(process_name, table: 'ProcessTable | None' = None):
+    return (table or ProcessTable.snapshot()).pids_by_name(process_name)
 
 
-def prase_MuMuVMMHeadless_commandline(headless_pid) -> dict:
+def prase_MuMuVMMHeadless_commandline(cmdline: list[str]) -> dict:
     parser = argparse.ArgumentParser(add_help=False)
     parser.add_argument('--comment')
 
-    parsed, unknown = parser.parse_known_args(get_process_command_line(headless_pid)[1:])
+    parsed, unknown = parser.parse_known_args(cmdline[1:])
     return {
-        'index': parsed.comment.split('-')[-1]
+        'index': parsed.comment.split('-')[-1] if parsed.comment else None
     }
 
 
-def prase_MuMuPlayer_commandline(player_pid) -> dict:
+def prase_MuMuPlayer_commandline(cmdline: list[str]) -> dict:
     parser = argparse.ArgumentParser(add_help=False)
     parser.add_argument('-v')
 
-    parsed, unknown = parser.parse_known_args(get_process_command_line(player_pid)[1:])
+    parsed, unknown = parser.parse_known_args(cmdline[1:])
     return {
         'index': parsed.v if parsed.v else '0'
     }
 
 
-def get_MuMuPlayer_by_MuMuVMMHeadless(headless_pid) -> int | None:
+MUMU_COMMANDLINE_PARSERS = {
+    'MuMuVMMHeadless.exe': prase_MuMuVMMHeadless_commandline,
+    'MuMuPlayer.exe': prase_MuMuPlayer_commandline
+}
+
+
+class ProcessTable:
+    '''
+    Snapshot of the processes and the local ports in use, taken with one process_iter and one net_connections,
+    indexed by pid, name, port and the instance index of MuMu processes. Lookups never touch the system again.
+    '''
+
+    def __init__(self, processes: list[dict], connections: list[tuple[int, int | None]]) -> None:
+        '''
+        processes: {'pid', 'name', 'cmdline'}, the cmdline is only needed for MuMu processes
+        connections: (local port, pid)
+        '''
+        self.names: dict[int, str] = {}
+        self._pids_by_name: dict[str, list[int]] = {}
+        self._pid_by_port: dict[int, int] = {}
+        self._mumu_index: dict[int, str] = {}
+        self._pids_by_mumu_index: dict[tuple[str, str], list[int]] = {}
+
+        for process in processes:
+            pid, name = process['pid'], process['name']
+            self.names[pid] = name
+            self._pids_by_name.setdefault(name, []).append(pid)
+            if name in MUMU_COMMANDLINE_PARSERS and process.get('cmdline'):
+                index = MUMU_COMMANDLINE_PARSERS[name](process['cmdline'])['index']
+                if index is not None:
+                    self._mumu_index[pid] = index
+                    self._pids_by_mumu_index.setdefault((name, index), []).append(pid)
+        for port, pid in connections:
+            if pid is not None:
+                self._pid_by_port.setdefault(port, pid)
+
+    @classmethod
+    def snapshot(cls) -> 'ProcessTable':
+        processes = []
+        for process in psutil.process_iter(['pid', 'name']):
+            try:
+                info = dict(process.info)
+                if info['name'] in MUMU_COMMANDLINE_PARSERS:
+                    info['cmdline'] = process.cmdline()
+                processes.append(info)
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+        try:
+            connections = [(conn.laddr.port, conn.pid) for conn in psutil.net_connections(kind='inet') if conn.laddr]
+        except psutil.AccessDenied as e:
+            logging.warning(f'Listing connections failed: {e}')
+            connections = []
+        return cls(processes, connections)
+
+    def pids_by_name(self, name) -> list[int]:
+        return list(self._pids_by_name.get(name, []))
+
+    def pid_by_port(self, port) -> int | None:
+        return self._pid_by_port.get(int(port))
+
+    def mumu_index(self, pid) -> str | None:
+        return self._mumu_index.get(pid)
+
+    def pids_by_mumu_index(self, name, index) -> list[int]:
+        return list(self._pids_by_mumu_index.get((name, index), []))
+
+
+def get_MuMuPlayer_by_MuMuVMMHeadless(headless_pid, table: ProcessTable | None = None) -> int | None:
     '''
     Can safely pass in None (return None)
     '''
     if not headless_pid:
         return None
-    index = prase_MuMuVMMHeadless_commandline(headless_pid)['index']
-    player_pids = [p for p in get_pids_by_process_name('MuMuPlayer.exe') if prase_MuMuPlayer_commandline(p)['index'] == index]
+    table = table or ProcessTable.snapshot()
+    index = table.mumu_index(headless_pid)
+    player_pids = table.pids_by_mumu_index('MuMuPlayer.exe', index) if index is not None else []
     if player_pids:
         return player_pids[0]
     else:
         return None
 
 
-def in_game_time(time, server='Official'):
+def in_game_time(moment: datetime, server='Official'):
     if server in ('Official', 'Bilibili', 'txwy'):
         zone = pytz.timezone('Asia/Shanghai')  # Asia/Taipei
     elif server in ('YoStarJP', 'YoStarKR'):
@@ -310,7 +364,7 @@ def in_game_time(time, server='Official'):
         zone = pytz.timezone('GMT')
     else:
         zone = pytz.timezone('Asia/Shanghai')
-    return (time.astimezone(timezone.utc)-timedelta(hours=4)).replace(tzinfo=pytz.utc).astimezone(zone)
+    return (moment.astimezone(timezone.utc)-timedelta(hours=4)).replace(tzinfo=pytz.utc).astimezone(zone)
 
 
 def byte_to_MB(byte):
@@ -400,59 +454,6 @@ def update_nav():
     pass
 
 
-def try_run(func: Callable, args: tuple, max_try_time=5, timeout=10, logger=None):
-    func_with_arg_str = f"{func.__name__}{str(args)}"
-
-    if not logger:
-        logger = logging.getLogger(func_with_arg_str)
-
-    class ThreadWithException(threading.Thread):
-        def __init__(self, name):
-            threading.Thread.__init__(self)
-            self.name = name
-            self.result = None
-
-        def run(self):
-            # target function of the thread class
-            try:  # 用try/finally 的方式处理exception，从而kill thread
-                func(*args)
-            except Exception as e:
-                logger.warning(f"Exception: {e}")
-                self.result = e
-                self.stop()
-
-        def get_id(self):
-            if hasattr(self, '_thread_id'):
-                return self._thread_id
-            for id, thread in threading._active.items():
-                if thread is self:
-                    return id
-
-        def stop(self):
-            thread_id = self.get_id()
-            res = ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id,
-                                                             ctypes.py_object(SystemExit))
-            if res > 1:
-                ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, 0)
-
-    for try_time in range(max_try_time):
-        logger.debug(f'{try_time+1}st/{max_try_time}max trying')
-        thread = ThreadWithException(func_with_arg_str)
-        thread.start()
-        thread.join(timeout)
-        result = thread.result
-        if not thread.is_alive() and not type(thread.result) == Exception:
-            return True, result
-        else:
-            logger.warning(f'{try_time+1}st/{max_try_time}max failed')
-            thread.stop()
-            thread.join(timeout)
-            del thread
-            continue
-
-    return False, result
-
-
 def download(url, path):
     path = str(path)
     logging.debug(f'Start to download from {url} to {path}')
@@ -17,4 +17,10 @@ config_templates: dict[dict]
 tasks: list[dict]
 
 verbose: bool
+profile: bool
+mode_args: dict
 start_time: datetime
+run_id: str
+
+# zygotes forked at startup, see maa_runner.prestart_zygotes
+zygote_pool = None
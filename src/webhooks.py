@@ -0,0 +1,140 @@
+'''
+Webhook delivery off the runner loop: events are queued and a background thread sends them to the hooks of global config
+(see HookConfig of easywebhooker), retrying failed requests with backoff. Progress events of a run are batched per hook.
+
+Events and their variables (available for url and body of hooks, besides `event` and `events`):
+    task-started    task, server, device
+    task-finished   task, server, device, succeed, reason, duration
+    maatask-failed  task, server, device, maatask, reason
+    run-failed, run-succeed, run-finished    report
+Progress events (the first three) arriving within batch_sec are delivered in one request per event type,
+`events` is the list of their variables and the other variables are those of the last one.
+Hooks without `when` only get the run-* events.
+'''
+import logging
+import queue
+import threading
+import time
+
+import easywebhooker
+import requests
+
+import var
+import metrics
+from retry import backoff_delays
+
+RUN_EVENTS = ['run-failed', 'run-succeed', 'run-finished']
+PROGRESS_EVENTS = ['task-started', 'task-finished', 'maatask-failed']
+# other codes will not change by sending the same request again
+RETRY_STATUS_CODES = [408, 429, 500, 502, 503, 504]
+
+DEFAULT_DELIVERY = {
+    'retries': 3,  # extra tries of a request which failed to connect or got one of RETRY_STATUS_CODES
+    'backoff_base': 1,
+    'backoff_cap': 30,
+    'batch_sec': 5,  # 0 delivers every progress event on its own
+    'flush_timeout': 30  # seconds the runner waits for the queue before exiting
+}
+
+
+def get_delivery_config() -> dict:
+    return {**DEFAULT_DELIVERY, **var.global_config.get('webhook_delivery', {})}
+
+
+class WebhookQueue:
+    def __init__(self, hooks: list[dict], retries=3, backoff_base=1, backoff_cap=30, batch_sec=5, **_) -> None:
+        self.hooks = [easywebhooker.HookConfig(**hook) if type(hook) == dict else hook for hook in hooks]
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.batch_sec = batch_sec
+        self._events = queue.Queue()
+        self._logger = logging.getLogger('webhook')
+        self._thread = threading.Thread(target=self._loop, name='webhook-delivery', daemon=True)
+        self._thread.start()
+
+    def subscribed(self, event) -> list[easywebhooker.HookConfig]:
+        return [hook for hook in self.hooks if event in ([hook.when] if type(hook.when) == str else hook.when or RUN_EVENTS)]
+
+    def emit(self, event, **variables):
+        '''
+        Never blocks. Events nobody subscribed to are dropped here
+        '''
+        if self.subscribed(event):
+            self._events.put((event, variables))
+
+    def flush(self, timeout) -> bool:
+        '''
+        Wait until everything emitted so far is delivered (or given up), at most timeout seconds
+        '''
+        flushed = threading.Event()
+        self._events.put(flushed)
+        if not flushed.wait(timeout):
+            self._logger.warning(f'Webhooks are not delivered after {timeout} sec, {self._events.qsize()} events are dropped')
+            return False
+        return True
+
+    def _loop(self):
+        batches: dict[str, list[dict]] = {}
+        deadline = None
+        while True:
+            try:
+                item = self._events.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if isinstance(item, tuple) and item[0] in PROGRESS_EVENTS and self.batch_sec > 0:
+                batches.setdefault(item[0], []).append(item[1])
+                deadline = deadline or time.monotonic() + self.batch_sec
+                continue
+            # anything else keeps the order: pending batches go first
+            for event, batch in batches.items():
+                self._deliver(event, {**batch[-1], 'events': batch})
+            batches, deadline = {}, None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not None:
+                event, variables = item
+                self._deliver(event, {**variables, 'events': [variables]})
+
+    def _deliver(self, event, variables: dict):
+        for hook in self.subscribed(event):
+            delays = backoff_delays(self.backoff_base, self.backoff_cap)
+            for tried_time in range(self.retries + 1):
+                try:
+                    response = easywebhooker.webhook(event, [hook], event=event, **variables)[hook]
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        result = 'ok' if response.ok else 'rejected'
+                        if not response.ok:
+                            self._logger.warning(f'{event} to {hook.url} was rejected with code {response.status_code}')
+                        break
+                    error = f'code {response.status_code}'
+                except requests.RequestException as e:
+                    error = str(e)
+                except Exception as e:
+                    # a hook which can not be rendered will not get better by retrying
+                    self._logger.error(f'{event} to {hook.url} failed: {e}')
+                    result = 'error'
+                    break
+                self._logger.warning(f'{event} to {hook.url} failed {tried_time + 1}st/{self.retries + 1}max trying: {error}')
+                result = 'failed'
+                if tried_time < self.retries:
+                    time.sleep(next(delays))
+            metrics.inc('arkhelper_webhook_deliveries_total', event=event, result=result)
+
+
+_queue: WebhookQueue | None = None
+
+
+def get_queue() -> WebhookQueue:
+    global _queue
+    if _queue is None:
+        _queue = WebhookQueue(var.global_config.get('webhook', None) or [], **get_delivery_config())
+    return _queue
+
+
+def emit(event, **variables):
+    get_queue().emit(event, **variables)
+
+
+def flush() -> bool:
+    return get_queue().flush(get_delivery_config()['flush_timeout'])
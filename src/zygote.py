@@ -0,0 +1,195 @@
+'''
+Fork-server mode (Linux only): one zygote process per client type loads MaaCore and its resources once,
+task processes are forked from the matching zygote and start with the resources in copy-on-write memory.
+
+The zygotes are forked by main.py before the CLI starts any thread (see maa_runner.prestart_zygotes), a zygote only
+forks from its main thread. A task process is tracked by a pidfd the zygote opens before it can be reaped, so that
+a pid reused after the task exited is never taken for the task.
+'''
+import logging
+import multiprocessing
+import os
+import pickle
+import select
+import signal
+from multiprocessing import reduction
+
+import model
+
+
+def is_supported() -> bool:
+    if not (hasattr(os, 'fork') and hasattr(os, 'pidfd_open') and 'fork' in multiprocessing.get_all_start_methods()):
+        return False
+    try:
+        # pidfds need Linux 5.3
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return False
+    return True
+
+
+def _reap():
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+
+def _zygote_main(client_type, conn):
+    logger = logging.getLogger(f'zygote({client_type})')
+    try:
+        model.preload_resource(client_type)
+    except Exception as e:
+        logger.error(f'Failed to preload resource: {e}', exc_info=True)
+        conn.send(('failed', str(e)))
+        return
+    logger.debug('Resource preloaded, ready to fork')
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            # exited children are only reaped here, by the zygote's main thread, so a pid is not reused before its pidfd is open
+            while not conn.poll(5):
+                _reap()
+            payload = conn.recv_bytes()
+        except EOFError:
+            break
+        if payload == b'stop':
+            break
+
+        _reap()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                conn.close()
+                # unpickled after fork, so that manager proxies connect from the task process itself
+                target, args = pickle.loads(payload)
+                target(*args)
+            except BaseException as e:
+                logger.error(f'Forked task process failed: {e}', exc_info=True)
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        pidfd = os.pidfd_open(pid)
+        conn.send(pid)
+        reduction.send_handle(conn, pidfd, None)
+        os.close(pidfd)
+    logger.debug('Exited')
+
+
+class Zygote:
+    def __init__(self, client_type) -> None:
+        self.client_type = client_type
+        self._conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.get_context('fork').Process(target=_zygote_main, args=(client_type, child_conn), daemon=True)
+        self._ready = None
+
+    def start(self):
+        self.process.start()
+
+    @property
+    def ready(self) -> bool:
+        if self._ready is None:
+            try:
+                state, detail = self._conn.recv()
+            except (EOFError, OSError) as e:
+                state, detail = 'died', repr(e)
+            self._ready = state == 'ready'
+            if not self._ready:
+                logging.warning(f'Zygote of {self.client_type} is not available: {detail}')
+        return self._ready
+
+    def fork(self, target, args) -> tuple[int, int]:
+        '''
+        (pid, pidfd) of the forked task process, the pidfd is owned by the caller.
+        EOFError or OSError when the zygote died, it is not ready anymore then
+        '''
+        try:
+            self._conn.send_bytes(pickle.dumps((target, args)))
+            pid = self._conn.recv()
+            return pid, reduction.recv_handle(self._conn)
+        except (EOFError, OSError):
+            self._ready = False
+            raise
+
+    def stop(self):
+        try:
+            self._conn.send_bytes(b'stop')
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class ForkedProcess:
+    '''
+    The part of multiprocessing.Process the runner needs, for a task process forked by a zygote.
+    If the zygote died, the task is started in a plain multiprocessing.Process instead
+    '''
+
+    def __init__(self, zygote: Zygote, target, args) -> None:
+        self._zygote = zygote
+        self._target = target
+        self._args = args
+        self.pid = None
+        self._pidfd = None
+        self._process: multiprocessing.Process | None = None
+
+    def start(self):
+        try:
+            self.pid, self._pidfd = self._zygote.fork(self._target, self._args)
+        except (EOFError, OSError) as e:
+            logging.error(f'Zygote of {self._zygote.client_type} died, the task process is started without it: {e!r}')
+            self._process = multiprocessing.Process(target=self._target, args=self._args)
+            self._process.start()
+            self.pid = self._process.pid
+
+    def kill(self):
+        if self._process:
+            self._process.kill()
+            return
+        if self._pidfd is None:
+            return
+        try:
+            signal.pidfd_send_signal(self._pidfd, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def is_alive(self) -> bool:
+        if self._process:
+            return self._process.is_alive()
+        if self._pidfd is None:
+            return False
+        # a pidfd is readable once its process exited
+        if select.select([self._pidfd], [], [], 0)[0]:
+            os.close(self._pidfd)
+            self._pidfd = None
+            return False
+        return True
+
+
+class ZygotePool:
+    def __init__(self) -> None:
+        self.zygotes: dict[str, Zygote] = {}
+
+    def prestart(self, client_types):
+        for client_type in client_types:
+            if client_type not in self.zygotes:
+                zygote = self.zygotes[client_type] = Zygote(client_type)
+                zygote.start()
+
+    def create_process(self, client_type, target, args):
+        self.prestart([client_type])
+        zygote = self.zygotes[client_type]
+        if zygote.ready:
+            return ForkedProcess(zygote, target, args)
+        return multiprocessing.Process(target=target, args=args)
+
+    def stop(self):
+        for zygote in self.zygotes.values():
+            zygote.stop()
+        self.zygotes.clear()